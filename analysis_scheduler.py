@@ -0,0 +1,428 @@
+import os
+import time
+import asyncio
+import hashlib
+import ipaddress
+import threading
+import itertools
+
+# Number of analyses that may run at the same time
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', 4))
+
+# Jobs estimated at or under this many tokens go in the interactive lane
+INTERACTIVE_MAX_TOKENS = int(os.environ.get('INTERACTIVE_MAX_TOKENS', 20000))
+
+# Every tenant may spend this many estimated tokens per budget window
+TENANT_TOKEN_BUDGET = int(os.environ.get('TENANT_TOKEN_BUDGET', 500000))
+TENANT_BUDGET_WINDOW = int(os.environ.get('TENANT_BUDGET_WINDOW', 3600))
+
+# Optional per-tenant weights for fair queuing, e.g. "key:1a2b3c4d:3,ip:5e6f7a8b:2"
+TENANT_WEIGHTS = os.environ.get('TENANT_WEIGHTS', '')
+
+# Comma separated X-API-Key values that get a tenant of their own; any other
+# caller is budgeted by client address so it cannot mint fresh budgets
+TENANT_API_KEYS = {key.strip() for key in os.environ.get('TENANT_API_KEYS', '').split(',') if key.strip()}
+
+# Proxies whose X-Forwarded-For header is believed, as comma separated
+# addresses or networks (e.g. "10.0.0.0/8"). "*" trusts whichever proxy
+# connects directly, for hosts like Render that are only reachable through
+# their own proxy.
+TRUSTED_PROXIES = os.environ.get('TRUSTED_PROXIES', '')
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+class QuotaExceededError(Exception):
+    """Raised when a tenant does not have enough token budget left for a job"""
+
+    def __init__(self, tenant, retry_after):
+        super().__init__(f"Token budget exceeded for {tenant}, retry in {retry_after:.0f} seconds")
+        self.tenant = tenant
+        self.retry_after = retry_after
+
+def parse_weights(value):
+    """
+    Parse TENANT_WEIGHTS into a dictionary
+
+    Args:
+        value: Comma separated "tenant:weight" entries; the weight is after the last colon
+
+    Returns:
+        Dictionary mapping tenant id to weight
+    """
+    weights = {}
+    for entry in value.split(','):
+        tenant, _, weight = entry.strip().rpartition(':')
+        if not tenant:
+            continue
+        try:
+            weights[tenant] = max(float(weight), 0.01)
+        except ValueError:
+            print(f"Ignoring invalid tenant weight: {entry}")
+    return weights
+
+def parse_trusted_proxies(value):
+    """
+    Parse TRUSTED_PROXIES
+
+    Args:
+        value: Comma separated addresses or networks, or "*"
+
+    Returns:
+        True to trust any directly connected proxy, otherwise a list of networks
+    """
+    if value.strip() == '*':
+        return True
+    networks = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(entry, strict=False))
+        except ValueError:
+            print(f"Ignoring invalid trusted proxy: {entry}")
+    return networks
+
+def _in_networks(address, networks):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+def client_address(peer_address, forwarded_for=None, trusted_proxies=None):
+    """
+    Find the address of the client behind any trusted proxies
+
+    X-Forwarded-For is read from the right, one hop per trusted proxy, so a
+    client cannot choose its own address by sending the header itself.
+
+    Args:
+        peer_address: Address of the socket peer
+        forwarded_for: Value of the X-Forwarded-For header
+        trusted_proxies: Value in TRUSTED_PROXIES format (default: TRUSTED_PROXIES)
+
+    Returns:
+        Address string
+    """
+    trusted = parse_trusted_proxies(TRUSTED_PROXIES if trusted_proxies is None else trusted_proxies)
+    hops = [hop.strip() for hop in (forwarded_for or '').split(',') if hop.strip()]
+    if trusted is True:
+        # Only the proxy that connected to us is trusted, so only its entry counts
+        return hops[-1] if hops else peer_address
+
+    address = peer_address
+    while hops and _in_networks(address, trusted):
+        address = hops.pop()
+    return address
+
+def tenant_id(api_key=None, client_address=None, api_keys=None):
+    """
+    Identify who a request is for
+
+    Only keys in the allowlist are trusted; unknown keys fall back to the
+    client address. Keys and addresses are hashed so they never show up in
+    stats.
+
+    Args:
+        api_key: Value of the X-API-Key header
+        client_address: IP address of the client
+        api_keys: Allowed API keys (default: TENANT_API_KEYS)
+
+    Returns:
+        Tenant id string
+    """
+    api_keys = TENANT_API_KEYS if api_keys is None else api_keys
+    if api_key and api_key in api_keys:
+        return 'key:' + _short_hash(api_key)
+    return 'ip:' + _short_hash(client_address or 'unknown')
+
+def _short_hash(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()[:8]
+
+class Tenant:
+    """Budget, fair queuing state and statistics for one tenant"""
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.tokens = TENANT_TOKEN_BUDGET
+        self.refilled_at = time.monotonic()
+        self.last_finish_tag = 0.0
+
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queued = 0
+        self.running = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.tokens_served = 0
+
+    def refill(self):
+        """Top the token budget back up in proportion to the time that has passed"""
+        now = time.monotonic()
+        rate = TENANT_TOKEN_BUDGET / TENANT_BUDGET_WINDOW
+        self.tokens = min(TENANT_TOKEN_BUDGET, self.tokens + (now - self.refilled_at) * rate)
+        self.refilled_at = now
+
+    def idle(self):
+        """Whether the tenant has nothing queued or running and a full budget"""
+        return self.queued == 0 and self.running == 0 and self.tokens >= TENANT_TOKEN_BUDGET
+
+    def retry_after(self, cost):
+        """Seconds until the budget has room for a job of this cost"""
+        rate = TENANT_TOKEN_BUDGET / TENANT_BUDGET_WINDOW
+        return (min(cost, TENANT_TOKEN_BUDGET) - self.tokens) / rate
+
+def tokens_used(result):
+    """
+    Read the tokens a finished analysis actually used from its 'usage'
+
+    Returns:
+        Prompt plus completion tokens, or None if the result does not say
+    """
+    usage = result.get('usage') if isinstance(result, dict) else None
+    if not isinstance(usage, dict) or 'prompt_tokens' not in usage:
+        return None
+    return int(usage.get('prompt_tokens', 0)) + int(usage.get('completion_tokens', 0))
+
+class Job:
+    """One queued analysis"""
+
+    def __init__(self, tenant, cost, func, args, charge):
+        self.tenant = tenant
+        self.cost = cost
+        self.charge = charge
+        self.func = func
+        self.args = args
+        self.lane = INTERACTIVE if cost <= INTERACTIVE_MAX_TOKENS else BULK
+        self.finish_tag = 0.0
+        self.enqueued_at = time.monotonic()
+        self.wait_time = 0.0
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class AnalysisScheduler:
+    """
+    Runs analyses on a fixed pool of workers, fairly across tenants
+
+    - Each tenant has a token budget that refills over TENANT_BUDGET_WINDOW;
+      jobs that do not fit are rejected with QuotaExceededError. A job is
+      charged its estimated cost up front and settled when it finishes:
+      failed jobs are refunded, and jobs that report 'usage' pay for the
+      tokens they actually used.
+    - Within a lane, jobs are ordered by weighted fair queuing: a job's finish
+      tag is its tenant's previous finish tag (or the current virtual time)
+      plus cost / weight, and the smallest finish tag runs first.
+    - Idle tenants with a full budget are forgotten whenever a new tenant
+      shows up, so the tenant table only holds recently active callers;
+      their statistics are added to one 'evicted' entry.
+    - Small jobs go in the interactive lane, which always runs before the bulk
+      lane. Bulk jobs may use at most MAX_CONCURRENT_JOBS - 1 workers, so one
+      worker is always free for interactive uploads.
+    - Coroutine functions all run on one long-lived event loop, so every
+      analysis shares a single connection pool and request limit.
+    """
+
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS, weights=None):
+        self.max_workers = max(max_workers, 1)
+        self.max_bulk_workers = max(self.max_workers - 1, 1)
+        self.weights = parse_weights(TENANT_WEIGHTS) if weights is None else weights
+        self.condition = threading.Condition()
+        self.tenants = {}
+        # Statistics of evicted tenants, folded together so totals stay whole
+        self.evicted = Tenant('evicted', 1.0)
+        self.evicted_count = 0
+        self.queues = {INTERACTIVE: [], BULK: []}
+        self.running = {INTERACTIVE: 0, BULK: 0}
+        self.virtual_time = 0.0
+        self.tokens_served = 0
+        self.sequence = itertools.count()
+
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="analysis-loop", daemon=True).start()
+        for i in range(self.max_workers):
+            threading.Thread(target=self._worker, name=f"analysis-worker-{i}", daemon=True).start()
+
+    def _tenant(self, name):
+        tenant = self.tenants.get(name)
+        if tenant is None:
+            self._evict_idle()
+            tenant = Tenant(name, self.weights.get(name, 1.0))
+            self.tenants[name] = tenant
+        return tenant
+
+    def _evict_idle(self):
+        """Drop tenants that would start from a clean slate anyway"""
+        for name, tenant in list(self.tenants.items()):
+            tenant.refill()
+            if tenant.idle():
+                del self.tenants[name]
+                self._retire(tenant)
+
+    def _retire(self, tenant):
+        """Add an evicted tenant's statistics to the 'evicted' entry"""
+        evicted = self.evicted
+        evicted.submitted += tenant.submitted
+        evicted.completed += tenant.completed
+        evicted.rejected += tenant.rejected
+        evicted.total_wait += tenant.total_wait
+        evicted.max_wait = max(evicted.max_wait, tenant.max_wait)
+        evicted.tokens_served += tenant.tokens_served
+        self.evicted_count += 1
+
+    def submit(self, tenant_name, cost, func, *args):
+        """
+        Queue an analysis and wait for it to finish
+
+        Args:
+            tenant_name: Tenant id from tenant_id()
+            cost: Estimated tokens the analysis will use
+            func: Function or coroutine function that runs the analysis
+            *args: Arguments for func
+
+        Returns:
+            Whatever func returns
+
+        Raises:
+            QuotaExceededError: if the tenant's budget cannot cover the job
+        """
+        with self.condition:
+            tenant = self._tenant(tenant_name)
+            tenant.refill()
+            # A job bigger than the whole budget may still run once the budget is full
+            charge = min(cost, TENANT_TOKEN_BUDGET)
+            if tenant.tokens < charge:
+                tenant.rejected += 1
+                raise QuotaExceededError(tenant_name, tenant.retry_after(cost))
+            tenant.tokens -= charge
+
+            job = Job(tenant, cost, func, args, charge)
+            start_tag = max(self.virtual_time, tenant.last_finish_tag)
+            job.finish_tag = start_tag + max(cost, 1) / tenant.weight
+            tenant.last_finish_tag = job.finish_tag
+            tenant.submitted += 1
+            tenant.queued += 1
+            self.queues[job.lane].append((job.finish_tag, next(self.sequence), job))
+            self.condition.notify()
+
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _next_job(self):
+        """Pick the next job to run, or None if nothing may run right now"""
+        lanes = [INTERACTIVE]
+        if self.running[BULK] < self.max_bulk_workers:
+            lanes.append(BULK)
+        for lane in lanes:
+            queue = self.queues[lane]
+            if queue:
+                entry = min(queue)
+                queue.remove(entry)
+                return entry[2]
+        return None
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                job = self._next_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self._next_job()
+
+                self.virtual_time = max(self.virtual_time, job.finish_tag - max(job.cost, 1) / job.tenant.weight)
+                self.running[job.lane] += 1
+                tenant = job.tenant
+                tenant.queued -= 1
+                tenant.running += 1
+                job.wait_time = time.monotonic() - job.enqueued_at
+                tenant.total_wait += job.wait_time
+                tenant.max_wait = max(tenant.max_wait, job.wait_time)
+
+            try:
+                if asyncio.iscoroutinefunction(job.func):
+                    future = asyncio.run_coroutine_threadsafe(job.func(*job.args), self.loop)
+                    job.result = future.result()
+                else:
+                    job.result = job.func(*job.args)
+            except Exception as e:
+                job.error = e
+
+            with self.condition:
+                self.running[job.lane] -= 1
+                tenant.running -= 1
+                tenant.completed += 1
+                served = self._settle(job)
+                tenant.tokens_served += served
+                self.tokens_served += served
+                # A bulk slot may have opened up
+                self.condition.notify_all()
+            job.done.set()
+
+    def _settle(self, job):
+        """
+        Replace a finished job's up-front charge with what it really cost
+
+        Returns:
+            Tokens to count as served for the job
+        """
+        tenant = job.tenant
+        if job.error is not None or job.result is None:
+            # Nothing useful came back, so the caller gets the charge back
+            used = 0
+        else:
+            used = tokens_used(job.result)
+            if used is None:
+                return job.cost
+        tenant.refill()
+        tenant.tokens = min(TENANT_TOKEN_BUDGET, tenant.tokens + job.charge - used)
+        return used
+
+    def stats(self):
+        """
+        Report queue and capacity usage per tenant
+
+        Returns:
+            Dictionary with overall counters, a 'tenants' list and an
+            'evicted' entry totalling the tenants that have been forgotten;
+            shareOfCapacity across both adds up to 1
+        """
+        with self.condition:
+            tenants = []
+            for tenant in self.tenants.values():
+                tenant.refill()
+                entry = self._tenant_stats(tenant)
+                entry['weight'] = tenant.weight
+                entry['queued'] = tenant.queued
+                entry['running'] = tenant.running
+                entry['budgetRemaining'] = int(tenant.tokens)
+                tenants.append(entry)
+            evicted = self._tenant_stats(self.evicted)
+            del evicted['tenant']
+            evicted['tenants'] = self.evicted_count
+            return {
+                'workers': self.max_workers,
+                'running': dict(self.running),
+                'queued': {lane: len(queue) for lane, queue in self.queues.items()},
+                'tokensServed': self.tokens_served,
+                'tenants': sorted(tenants, key=lambda t: -t['tokensServed']),
+                'evicted': evicted
+            }
+
+    def _tenant_stats(self, tenant):
+        started = tenant.completed + tenant.running
+        return {
+            'tenant': tenant.name,
+            'submitted': tenant.submitted,
+            'completed': tenant.completed,
+            'rejected': tenant.rejected,
+            'avgWaitSeconds': round(tenant.total_wait / started, 3) if started else 0.0,
+            'maxWaitSeconds': round(tenant.max_wait, 3),
+            'tokensServed': tenant.tokens_served,
+            'shareOfCapacity': round(tenant.tokens_served / self.tokens_served, 3) if self.tokens_served else 0.0
+        }
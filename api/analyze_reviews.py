@@ -1,15 +1,26 @@
 import os
 import json
+import gzip
+import hashlib
 import tempfile
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
 import sys
 import io
 import re
-from urllib.parse import urlparse
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Add the parent directory to the path so we can import the review_analyzer module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from review_analyzer import process_excel_file, get_fake_reviews_list, get_review_stats
+from review_analyzer import process_reviews_async, get_fake_reviews_list, get_review_stats, load_reviews, estimate_analysis_tokens
+from analysis_scheduler import AnalysisScheduler, QuotaExceededError, tenant_id, client_address, MAX_CONCURRENT_JOBS
+from review_index import get_default_index
 
 # Get the API key from environment variable
 API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
@@ -17,10 +28,159 @@ API_KEY = os.environ.get('OPENROUTER_API_KEY', '')
 # Get allowed origins from environment variable or use default
 ALLOWED_ORIGINS = os.environ.get('ALLOWED_ORIGINS', '*').split(',')
 
+# Responses smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+# Number of analysis results kept in memory for /api/results
+MAX_CACHED_RESULTS = int(os.environ.get('MAX_CACHED_RESULTS', 100))
+
+# Default and maximum page size for paginated fakeReviews
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Default and maximum number of neighbours returned by /api/similar
+DEFAULT_SIMILAR_K = 10
+MAX_SIMILAR_K = 100
+
+# Most recent analysis results by result id, oldest first
+RESULT_CACHE = OrderedDict()
+RESULT_CACHE_LOCK = threading.Lock()
+
+# Queues analyses fairly across tenants; created when the server starts
+SCHEDULER = None
+
+# Uploads are parsed on the request thread to estimate their cost; parse no
+# more of them at once than the scheduler would analyze
+PARSE_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_JOBS)
+
+def get_scheduler():
+    """Get the analysis scheduler, starting its workers on first use"""
+    global SCHEDULER
+    if SCHEDULER is None:
+        SCHEDULER = AnalysisScheduler()
+    return SCHEDULER
+
+def store_result(data):
+    """
+    Keep an analysis result so it can be fetched again from /api/results
+
+    Args:
+        data: Dictionary with 'stats' and 'fakeReviews'
+
+    Returns:
+        The content-hash id of the result
+    """
+    canonical = json.dumps(data, sort_keys=True, separators=(',', ':')).encode()
+    result_id = hashlib.sha256(canonical).hexdigest()[:16]
+    with RESULT_CACHE_LOCK:
+        RESULT_CACHE[result_id] = data
+        RESULT_CACHE.move_to_end(result_id)
+        while len(RESULT_CACHE) > MAX_CACHED_RESULTS:
+            RESULT_CACHE.popitem(last=False)
+    return result_id
+
+def paginate_result(data, result_id, query):
+    """
+    Build the response body for a result, paginating fakeReviews if asked to
+
+    Args:
+        data: Dictionary with 'stats' and 'fakeReviews'
+        result_id: Id of the stored result
+        query: Parsed query string; 'page' and 'pageSize' select a page
+
+    Returns:
+        Response dictionary
+    """
+    response = {'resultId': result_id, 'stats': data['stats']}
+    for key in ('incomplete', 'failedBatches', 'totalBatches'):
+        if key in data:
+            response[key] = data[key]
+    fake_reviews = data['fakeReviews']
+    if 'page' not in query and 'pageSize' not in query:
+        response['fakeReviews'] = fake_reviews
+        return response
+
+    try:
+        page = max(int(query.get('page', ['1'])[0]), 1)
+        page_size = int(query.get('pageSize', [str(DEFAULT_PAGE_SIZE)])[0])
+    except ValueError:
+        page, page_size = 1, DEFAULT_PAGE_SIZE
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+
+    start = (page - 1) * page_size
+    response['fakeReviews'] = fake_reviews[start:start + page_size]
+    response['page'] = page
+    response['pageSize'] = page_size
+    response['totalFakeReviews'] = len(fake_reviews)
+    response['totalPages'] = (len(fake_reviews) + page_size - 1) // page_size
+    return response
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the best response encoding the client accepts
+
+    Args:
+        accept_encoding: Value of the Accept-Encoding request header
+
+    Returns:
+        'br', 'gzip' or None
+    """
+    accepted = {}
+    for item in accept_encoding.split(','):
+        parts = item.strip().split(';')
+        name = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            param = param.strip()
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name] = quality
+
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+def etag_matches(if_none_match, content_hash):
+    """
+    Check an If-None-Match header against the hash of a response body
+
+    Uses weak comparison: a W/ prefix and the encoding suffix of our ETags
+    are ignored, so a tag received with any encoding still matches.
+
+    Args:
+        if_none_match: Value of the If-None-Match request header
+        content_hash: Hash of the uncompressed response body
+
+    Returns:
+        True if the client already has this content
+    """
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        opaque = tag.strip('"')
+        for encoding in ('br', 'gzip'):
+            if opaque.endswith('-' + encoding):
+                opaque = opaque[:-len(encoding) - 1]
+        if opaque and opaque == content_hash:
+            return True
+    return False
+
 class ReviewAnalyzerHandler(BaseHTTPRequestHandler):
-    def _set_headers(self, content_type='application/json'):
-        self.send_response(200)
+    def _set_headers(self, content_type='application/json', status=200, extra_headers=None):
+        self.send_response(status)
         self.send_header('Content-type', content_type)
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
 
         # Handle CORS - Always allow all origins for simplicity
         # This is safe for this application since we're not handling sensitive data
@@ -28,11 +188,51 @@ class ReviewAnalyzerHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
 
         self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Origin, Accept, X-Requested-With')
+        self.send_header('Access-Control-Allow-Headers',
+                         'Content-Type, Origin, Accept, Accept-Encoding, X-Requested-With, If-None-Match, X-API-Key')
+        self.send_header('Access-Control-Expose-Headers', 'ETag, Retry-After')
         self.send_header('Access-Control-Allow-Credentials', 'true')
         self.send_header('Access-Control-Max-Age', '86400')  # 24 hours
         self.end_headers()
 
+    def _send_json(self, data, conditional=False):
+        """
+        Send a JSON response with a content-hash ETag, compressed if the client allows it
+
+        Args:
+            data: Object to serialize
+            conditional: Answer with 304 Not Modified if If-None-Match matches the ETag
+        """
+        body = json.dumps(data, separators=(',', ':')).encode()
+        content_hash = hashlib.sha256(body).hexdigest()[:32]
+
+        encoding = None
+        if len(body) >= MIN_COMPRESS_SIZE:
+            encoding = choose_encoding(self.headers.get('Accept-Encoding', ''))
+
+        # Each encoding is a different representation, so it gets its own strong ETag
+        etag = f'"{content_hash}-{encoding}"' if encoding else f'"{content_hash}"'
+        headers = {
+            'ETag': etag,
+            'Cache-Control': 'private, no-cache',
+            'Vary': 'Accept-Encoding'
+        }
+
+        if conditional and etag_matches(self.headers.get('If-None-Match', ''), content_hash):
+            self._set_headers(status=304, extra_headers=headers)
+            return
+
+        if encoding == 'br':
+            body = brotli.compress(body)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+
+        headers['Content-Length'] = str(len(body))
+        self._set_headers(extra_headers=headers)
+        self.wfile.write(body)
+
     def do_OPTIONS(self):
         self._set_headers()
 
@@ -41,19 +241,61 @@ class ReviewAnalyzerHandler(BaseHTTPRequestHandler):
         self.end_headers()
 
     def do_GET(self):
-        if self.path == '/':
+        url = urlparse(self.path)
+        if url.path == '/':
             self.send_response(200)
             self.send_header('Content-type', 'text/plain')
             self.end_headers()
             self.wfile.write(b'API server is running')
-        elif self.path == '/api/analyze':
+        elif url.path == '/api/analyze':
             # For preflight checks or health checks
             self._set_headers()
             self.wfile.write(json.dumps({'status': 'ready'}).encode())
+        elif url.path.startswith('/api/results/'):
+            result_id = url.path[len('/api/results/'):]
+            data = RESULT_CACHE.get(result_id)
+            if data is None:
+                self._set_headers(status=404)
+                self.wfile.write(json.dumps({'error': 'Result not found'}).encode())
+                return
+            self._send_json(paginate_result(data, result_id, parse_qs(url.query)), conditional=True)
+        elif url.path == '/api/similar':
+            self.handle_similar(parse_qs(url.query))
+        elif url.path == '/api/scheduler':
+            # Queue wait time and share of capacity per tenant
+            self._send_json(get_scheduler().stats())
         else:
             self.send_response(404)
             self.end_headers()
 
+    def handle_similar(self, query):
+        """Return the indexed reviews most similar to a query text (q) or review id (id)"""
+        index = get_default_index()
+        if index is None:
+            self._set_headers(status=503)
+            self.wfile.write(json.dumps({'error': 'Review index is disabled'}).encode())
+            return
+
+        text = query.get('q', [None])[0]
+        rid = query.get('id', [None])[0]
+        if not text and not rid:
+            self._set_headers(status=400)
+            self.wfile.write(json.dumps({'error': 'Provide a review text (q) or review id (id)'}).encode())
+            return
+
+        try:
+            k = int(query.get('k', [str(DEFAULT_SIMILAR_K)])[0])
+        except ValueError:
+            k = DEFAULT_SIMILAR_K
+        k = min(max(k, 1), MAX_SIMILAR_K)
+
+        results = index.search(text=text, rid=rid, k=k)
+        if results is None:
+            self._set_headers(status=404)
+            self.wfile.write(json.dumps({'error': 'Review not found'}).encode())
+            return
+        self._send_json({'results': results}, conditional=True)
+
     def parse_multipart_form(self):
         """Parse multipart form data without using the cgi module"""
         content_type = self.headers.get('Content-Type', '')
@@ -131,7 +373,8 @@ class ReviewAnalyzerHandler(BaseHTTPRequestHandler):
         print(f"Received POST request to {self.path}")
         print(f"Headers: {dict(self.headers)}")
 
-        if self.path == '/api/analyze':
+        url = urlparse(self.path)
+        if url.path == '/api/analyze':
             try:
                 # Parse the form data
                 form_data = self.parse_multipart_form()
@@ -168,7 +411,22 @@ class ReviewAnalyzerHandler(BaseHTTPRequestHandler):
                     if isinstance(model_id, dict) and 'content' in model_id:
                         model_id = model_id['content'].decode('utf-8')
 
-                    result = process_excel_file(temp_file_path, API_KEY, model_id)
+                    # Parse once and estimate the cost up front so the scheduler can
+                    # budget and prioritize it; the job reuses the parsed reviews
+                    with PARSE_SLOTS:
+                        reviews = load_reviews(temp_file_path)
+                    if reviews is None:
+                        os.unlink(temp_file_path)
+                        self._set_headers()
+                        self.wfile.write(json.dumps({'error': 'Could not read the uploaded file'}).encode())
+                        return
+
+                    address = client_address(self.client_address[0], self.headers.get('X-Forwarded-For'))
+                    tenant = tenant_id(self.headers.get('X-API-Key'), address)
+                    cost = estimate_analysis_tokens(reviews)
+                    print(f"Queueing analysis of {len(reviews)} reviews (~{cost} tokens) for {tenant}")
+                    result = get_scheduler().submit(tenant, cost, process_reviews_async, reviews, temp_file_path,
+                                                  API_KEY, model_id)
 
                     # Delete the temporary file
                     os.unlink(temp_file_path)
@@ -178,15 +436,23 @@ class ReviewAnalyzerHandler(BaseHTTPRequestHandler):
                         fake_reviews = get_fake_reviews_list(result)
                         stats = get_review_stats(result)
 
-                        # Return the results
-                        self._set_headers()
-                        self.wfile.write(json.dumps({
-                            'stats': stats,
-                            'fakeReviews': fake_reviews
-                        }).encode())
+                        # Keep the result so its pages can be fetched later, then return it
+                        data = {'stats': stats, 'fakeReviews': fake_reviews}
+                        if result.get('incomplete'):
+                            # Some batches failed, so the stats only cover part of the upload
+                            data['incomplete'] = True
+                            data['failedBatches'] = result['usage']['failed_requests']
+                            data['totalBatches'] = result['usage']['requests']
+                        result_id = store_result(data)
+                        self._send_json(paginate_result(data, result_id, parse_qs(url.query)))
                     else:
                         self._set_headers()
                         self.wfile.write(json.dumps({'error': 'Failed to analyze reviews'}).encode())
+                except QuotaExceededError as e:
+                    os.unlink(temp_file_path)
+
+                    self._set_headers(status=429, extra_headers={'Retry-After': str(max(int(e.retry_after), 1))})
+                    self.wfile.write(json.dumps({'error': str(e)}).encode())
                 except Exception as e:
                     # Delete the temporary file if it exists
                     if os.path.exists(temp_file_path):
@@ -210,7 +476,9 @@ def run_server(port=8000):
 
     # For Render deployment, we need to listen on 0.0.0.0
     server_address = ('0.0.0.0', port)
-    httpd = HTTPServer(server_address, ReviewAnalyzerHandler)
+    # Requests are served on their own threads; the scheduler limits how many analyses run at once
+    httpd = ThreadingHTTPServer(server_address, ReviewAnalyzerHandler)
+    get_scheduler()
     print(f"Starting server on port {port}...")
     httpd.serve_forever()
 
@@ -1,66 +1,244 @@
-import requests
+import sys
 import json
-import argparse
 import time
+import asyncio
+import argparse
+from openrouter_client import stream_chat_completion, run_sync, OpenRouterError
+from token_budget import estimate_tokens
+
+# Default token budget for the conversation history sent with each turn
+DEFAULT_HISTORY_TOKENS = 4000
 
-def chat_with_model(api_key, prompt, model_id="thudm/glm-4-9b:free"):
+async def chat_with_model_async(api_key, messages, model_id="thudm/glm-4-9b:free", on_token=None, client=None):
     """
-    Chat with a free model on OpenRouter
-    
+    Chat with a free model on OpenRouter, streaming the answer as it is generated
+
     Args:
         api_key: Your OpenRouter API key
-        prompt: The text prompt to send to the model
+        messages: The prompt text, or a list of chat messages
         model_id: The ID of the model to use
-    
+        on_token: Optional callback called with each piece of text as it arrives
+        client: Optional httpx.AsyncClient to use instead of the shared pool
+
     Returns:
-        The model's response
+        Tuple of (response text or None, stats dictionary with 'model',
+        'ttft' (seconds to first token), 'elapsed', 'completion_tokens'
+        and 'tokens_per_second')
     """
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    # OpenRouter API endpoint
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+
     # Request payload
     payload = {
         "model": model_id,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
+        "messages": messages
     }
-    
-    print(f"Sending request to {model_id}...")
+
     start_time = time.time()
-    
+    first_token_time = None
+    parts = []
+    usage = {}
+    model_used = None
+
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        
-        if response.status_code == 200:
-            result = response.json()
-            # Extract the model's response
-            if "choices" in result and len(result["choices"]) > 0:
-                message = result["choices"][0]["message"]["content"]
-                model_used = result.get("model", "Unknown model")
-                print(f"\n✅ Response from {model_used} (took {elapsed_time:.2f} seconds):")
-                print("-" * 70)
-                print(message)
-                print("-" * 70)
-                return message
+        async for event in stream_chat_completion(api_key, payload, client):
+            if 'content' in event:
+                if first_token_time is None:
+                    first_token_time = time.time()
+                parts.append(event['content'])
+                if on_token is not None:
+                    on_token(event['content'])
             else:
-                print(f"❌ Unexpected response format: {result}")
-                return None
-        else:
-            print(f"❌ Request failed with status code: {response.status_code}")
-            print(f"Response: {response.text}")
-            return None
+                usage = event['usage']
+                model_used = event['model']
+    except OpenRouterError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        print(f"Response: {e.response_text}", file=sys.stderr)
+        return None, None
     except Exception as e:
-        print(f"❌ Error occurred: {str(e)}")
+        print(f"❌ Error occurred: {str(e)}", file=sys.stderr)
+        return None, None
+
+    end_time = time.time()
+    message = "".join(parts)
+    completion_tokens = usage.get("completion_tokens") or estimate_tokens(message)
+    generation_time = end_time - (first_token_time or start_time)
+    stats = {
+        'model': model_used or model_id,
+        'ttft': (first_token_time or end_time) - start_time,
+        'elapsed': end_time - start_time,
+        'completion_tokens': completion_tokens,
+        'tokens_per_second': completion_tokens / generation_time if generation_time > 0 else 0.0
+    }
+    return message, stats
+
+def format_stats(stats):
+    """Format the timing of one answer for display"""
+    return (f"{stats['elapsed']:.2f}s total, {stats['ttft']:.2f}s to first token, "
+            f"{stats['completion_tokens']} tokens at {stats['tokens_per_second']:.1f} tokens/s")
+
+async def chat_turn_async(api_key, prompt, model_id="thudm/glm-4-9b:free", stream=True):
+    """
+    Send one prompt and print the answer, from inside a running event loop
+
+    Args:
+        api_key: Your OpenRouter API key
+        prompt: The text prompt to send to the model, or a list of chat messages
+        model_id: The ID of the model to use
+        stream: Print the answer as it is generated instead of all at once
+
+    Returns:
+        The model's response
+    """
+    print(f"Sending request to {model_id}...")
+
+    if stream:
+        print("-" * 70)
+        on_token = lambda text: print(text, end="", flush=True)
+    else:
+        on_token = None
+
+    message, stats = await chat_with_model_async(api_key, prompt, model_id, on_token)
+    if message is None:
         return None
 
+    if stream:
+        print()
+        print("-" * 70)
+        print(f"✅ Response from {stats['model']} ({format_stats(stats)})")
+    else:
+        print(f"\n✅ Response from {stats['model']} ({format_stats(stats)}):")
+        print("-" * 70)
+        print(message)
+        print("-" * 70)
+    return message
+
+def chat_with_model(api_key, prompt, model_id="thudm/glm-4-9b:free", stream=True):
+    """
+    Chat with a free model on OpenRouter
+
+    Args:
+        api_key: Your OpenRouter API key
+        prompt: The text prompt to send to the model, or a list of chat messages
+        model_id: The ID of the model to use
+        stream: Print the answer as it is generated instead of all at once
+
+    Returns:
+        The model's response
+    """
+    return run_sync(chat_turn_async(api_key, prompt, model_id, stream))
+
+def trim_history(messages, max_tokens):
+    """
+    Drop the oldest turns until the conversation fits in a token budget
+
+    The most recent message is always kept.
+
+    Args:
+        messages: List of chat messages, oldest first
+        max_tokens: Token budget for the whole conversation
+
+    Returns:
+        The trimmed list of messages
+    """
+    trimmed = list(messages)
+    total = sum(estimate_tokens(message["content"]) for message in trimmed)
+    while len(trimmed) > 1 and total > max_tokens:
+        total -= estimate_tokens(trimmed.pop(0)["content"])
+    # Don't start the conversation with an orphaned answer
+    while len(trimmed) > 1 and trimmed[0]["role"] == "assistant":
+        trimmed.pop(0)
+    return trimmed
+
+async def run_batch(api_key, prompts, model_id):
+    """
+    Send many prompts concurrently over the shared connection pool
+
+    Args:
+        api_key: Your OpenRouter API key
+        prompts: List of prompt texts
+        model_id: The ID of the model to use
+
+    Returns:
+        Tuple of (list of (response, stats) in prompt order, wall time in seconds)
+    """
+    start_time = time.time()
+    results = await asyncio.gather(*(chat_with_model_async(api_key, prompt, model_id) for prompt in prompts))
+    return results, time.time() - start_time
+
+def batch_mode(api_key, source, model_id, output_jsonl=False):
+    """
+    Answer every prompt in a file (one per line, '-' for stdin) concurrently
+
+    Args:
+        api_key: Your OpenRouter API key
+        source: Path of the prompt file, or '-' to read from stdin
+        model_id: The ID of the model to use
+        output_jsonl: Print one JSON object per answer instead of readable text
+    """
+    if source == '-':
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(source, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    prompts = [line.strip() for line in lines if line.strip()]
+    if not prompts:
+        print("No prompts to send", file=sys.stderr)
+        return
+
+    print(f"Sending {len(prompts)} prompts to {model_id}...", file=sys.stderr)
+    results, wall_time = run_sync(run_batch(api_key, prompts, model_id))
+
+    for i, (prompt, (message, stats)) in enumerate(zip(prompts, results)):
+        if output_jsonl:
+            print(json.dumps({'prompt': prompt, 'response': message, 'stats': stats}))
+            continue
+        print(f"\n[{i+1}] You: {prompt}")
+        if message is None:
+            print("❌ No response")
+            continue
+        print("-" * 70)
+        print(message)
+        print("-" * 70)
+        print(f"({format_stats(stats)})")
+
+    answered = [stats for _, stats in results if stats]
+    total_tokens = sum(stats['completion_tokens'] for stats in answered)
+    summary = f"\n{len(answered)}/{len(prompts)} prompts answered in {wall_time:.2f}s"
+    if answered:
+        mean_ttft = sum(stats['ttft'] for stats in answered) / len(answered)
+        summary += (f", mean time to first token {mean_ttft:.2f}s, "
+                    f"throughput {total_tokens / wall_time:.1f} tokens/s")
+    print(summary, file=sys.stderr)
+
+async def interactive_mode(api_key, model_id, stream=True, history_tokens=DEFAULT_HISTORY_TOKENS):
+    """
+    Keep a conversation going until the user enters 'q'
+
+    Every turn runs on the same event loop, so the connection to OpenRouter
+    is reused for the whole session.
+
+    Args:
+        api_key: Your OpenRouter API key
+        model_id: The ID of the model to use
+        stream: Print answers as they are generated instead of all at once
+        history_tokens: Token budget for the conversation history sent with each turn
+    """
+    history = []
+    while True:
+        prompt = await asyncio.to_thread(input, "\nYou: ")
+        if prompt.lower() == 'q':
+            break
+
+        history.append({"role": "user", "content": prompt})
+        history = trim_history(history, history_tokens)
+        message = await chat_turn_async(api_key, history, model_id, stream)
+        if message is None:
+            # Forget the unanswered question so the next turn starts clean
+            history.pop()
+        else:
+            history.append({"role": "assistant", "content": message})
+
 def list_free_models():
     """Display a list of recommended free models"""
     print("\nRecommended Free Models:")
@@ -75,32 +253,35 @@ def list_free_models():
 def main():
     parser = argparse.ArgumentParser(description="Chat with a free AI model using OpenRouter")
     parser.add_argument("--api-key", required=True, help="Your OpenRouter API key")
-    parser.add_argument("--model", default="thudm/glm-4-9b:free", 
+    parser.add_argument("--model", default="thudm/glm-4-9b:free",
                         help="Model ID to use (default: thudm/glm-4-9b:free)")
     parser.add_argument("--list-models", action="store_true", help="List recommended free models")
     parser.add_argument("--prompt", help="The prompt to send to the model")
-    
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Send every line of FILE as a separate prompt, concurrently ('-' reads stdin)")
+    parser.add_argument("--jsonl", action="store_true", help="In batch mode, print one JSON object per answer")
+    parser.add_argument("--no-stream", action="store_true", help="Print answers only once they are complete")
+    parser.add_argument("--history-tokens", type=int, default=DEFAULT_HISTORY_TOKENS,
+                        help=f"Token budget for conversation history in interactive mode (default: {DEFAULT_HISTORY_TOKENS})")
+
     args = parser.parse_args()
-    
+    stream = not args.no_stream
+
     if args.list_models:
         list_free_models()
         return
-    
-    if not args.prompt:
+
+    if args.batch:
+        batch_mode(args.api_key, args.batch, args.model, args.jsonl)
+    elif not args.prompt:
         # Interactive mode
         list_free_models()
         print("\nEnter 'q' to quit at any time.")
         print(f"Using model: {args.model}")
-        
-        while True:
-            prompt = input("\nYou: ")
-            if prompt.lower() == 'q':
-                break
-                
-            chat_with_model(args.api_key, prompt, args.model)
+        run_sync(interactive_mode(args.api_key, args.model, stream, args.history_tokens))
     else:
         # Single prompt mode
-        chat_with_model(args.api_key, args.prompt, args.model)
+        chat_with_model(args.api_key, args.prompt, args.model, stream)
 
 if __name__ == "__main__":
     main()
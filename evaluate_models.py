@@ -0,0 +1,264 @@
+import os
+import sys
+import csv
+import time
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+import pandas as pd
+import model_replay
+from openrouter_client import run_sync
+from review_analyzer import analyze_reviews_async, OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT
+
+# Columns that may hold the ground truth label in a labelled review set
+LABEL_COLUMNS = ['Label', 'label', 'Classification', 'Is Fake', 'is_fake']
+
+FAKE_LABELS = {'FAKE', '1', 'TRUE', 'YES'}
+REAL_LABELS = {'REAL', '0', 'FALSE', 'NO'}
+
+def load_labelled_reviews(file_path):
+    """
+    Read a labelled review set from an Excel or CSV file
+
+    The file needs the usual Reviewer Name, Star Rating and Review Text
+    columns plus a label column (REAL/FAKE, or 1/0 with 1 meaning fake).
+
+    Args:
+        file_path: Path to the .xlsx or .csv file
+
+    Returns:
+        Tuple of (reviews, labels), or None if the file could not be used
+    """
+    try:
+        if file_path.lower().endswith('.csv'):
+            df = pd.read_csv(file_path)
+        else:
+            df = pd.read_excel(file_path)
+    except Exception as e:
+        print(f"Error reading file {file_path}: {str(e)}")
+        return None
+
+    label_column = next((column for column in LABEL_COLUMNS if column in df.columns), None)
+    if label_column is None:
+        print(f"No label column found in {file_path}, expected one of: {', '.join(LABEL_COLUMNS)}")
+        return None
+
+    reviews = []
+    labels = []
+    for _, row in df.iterrows():
+        label = str(row[label_column]).strip().upper()
+        if label.endswith('.0'):
+            label = label[:-2]
+        if label in FAKE_LABELS:
+            labels.append('FAKE')
+        elif label in REAL_LABELS:
+            labels.append('REAL')
+        else:
+            continue
+        reviews.append({
+            'reviewer_name': row.get('Reviewer Name', 'Anonymous'),
+            'star_rating': row.get('Star Rating', 'N/A'),
+            'review_text': row.get('Review Text', '')
+        })
+    return reviews, labels
+
+def predictions_by_index(analysis_result, count):
+    """
+    Line up the model's classifications with the input reviews
+
+    Args:
+        analysis_result: Dictionary with analysis results, or None
+        count: Number of reviews that were sent
+
+    Returns:
+        List of 'REAL', 'FAKE' or None (no usable answer) per review
+    """
+    predictions = [None] * count
+    if not analysis_result:
+        return predictions
+    for review in analysis_result.get('reviews', []):
+        index = review.get('index')
+        classification = str(review.get('classification', '')).upper()
+        if index is not None and 0 <= index < count and classification in ('REAL', 'FAKE'):
+            predictions[index] = classification
+    return predictions
+
+async def run_configuration(reviews, api_key, model_id, batch_size, output_format):
+    """
+    Analyze the review set once with one configuration
+
+    Returns:
+        Dictionary with the predictions, usage and wall time of the run
+    """
+    start_time = time.time()
+    analysis_result = await analyze_reviews_async(reviews, api_key, model_id, output_format=output_format,
+                                                  max_batch_reviews=batch_size)
+    wall_time = time.time() - start_time
+
+    return {
+        'model': model_id,
+        'batch_size': batch_size,
+        'format': output_format,
+        'predictions': predictions_by_index(analysis_result, len(reviews)),
+        'usage': (analysis_result or {}).get('usage', {}),
+        'wall_time': wall_time
+    }
+
+def score_run(run, labels, consensus):
+    """
+    Compute quality and cost metrics for one run
+
+    Args:
+        run: Result of run_configuration
+        labels: Ground truth label per review
+        consensus: Majority prediction per review across all runs
+
+    Returns:
+        Dictionary of metrics
+    """
+    predictions = run['predictions']
+    true_positives = sum(1 for p, l in zip(predictions, labels) if p == 'FAKE' and l == 'FAKE')
+    false_positives = sum(1 for p, l in zip(predictions, labels) if p == 'FAKE' and l == 'REAL')
+    false_negatives = sum(1 for p, l in zip(predictions, labels) if p != 'FAKE' and l == 'FAKE')
+    correct = sum(1 for p, l in zip(predictions, labels) if p == l)
+    answered = [i for i, p in enumerate(predictions) if p is not None]
+    agreed = sum(1 for i in answered if predictions[i] == consensus[i])
+
+    usage = run['usage']
+    requests = usage.get('requests', 0)
+    total_tokens = usage.get('prompt_tokens', 0) + usage.get('completion_tokens', 0)
+
+    return {
+        'model': run['model'],
+        'batch_size': run['batch_size'] or 'auto',
+        'format': run['format'],
+        'precision': true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0,
+        'recall': true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0,
+        'accuracy': correct / len(labels) if labels else 0.0,
+        'agreement': agreed / len(answered) if answered else 0.0,
+        'coverage': len(answered) / len(labels) if labels else 0.0,
+        'tokens_per_review': total_tokens / len(labels) if labels else 0.0,
+        'requests': requests,
+        'failed_parse_rate': usage.get('failed_requests', 0) / requests if requests else 1.0,
+        'avg_request_latency': usage.get('request_time', 0) / max(requests - usage.get('failed_requests', 0), 1),
+        'wall_time': run['wall_time']
+    }
+
+async def evaluate(reviews, labels, api_key, models, batch_sizes, output_formats):
+    """
+    Run every combination of model, batch size and output format concurrently
+
+    Returns:
+        List of metric dictionaries, one per configuration
+    """
+    configurations = list(itertools.product(models, batch_sizes, output_formats))
+    runs = await asyncio.gather(*(
+        run_configuration(reviews, api_key, model_id, batch_size, output_format)
+        for model_id, batch_size, output_format in configurations
+    ))
+
+    # Majority vote across configurations, used to measure agreement
+    consensus = []
+    for i in range(len(reviews)):
+        votes = Counter(run['predictions'][i] for run in runs if run['predictions'][i] is not None)
+        consensus.append(votes.most_common(1)[0][0] if votes else None)
+
+    return [score_run(run, labels, consensus) for run in runs]
+
+TABLE_COLUMNS = [
+    ('model', 'Model', '{}'),
+    ('batch_size', 'Batch', '{}'),
+    ('format', 'Format', '{}'),
+    ('precision', 'Prec', '{:.2f}'),
+    ('recall', 'Recall', '{:.2f}'),
+    ('accuracy', 'Acc', '{:.2f}'),
+    ('agreement', 'Agree', '{:.2f}'),
+    ('coverage', 'Cover', '{:.2f}'),
+    ('tokens_per_review', 'Tok/rev', '{:.0f}'),
+    ('avg_request_latency', 'Lat(s)', '{:.2f}'),
+    ('wall_time', 'Wall(s)', '{:.2f}'),
+    ('failed_parse_rate', 'Fail', '{:.2f}'),
+]
+
+def print_table(rows):
+    """Print the evaluation results as an aligned text table"""
+    cells = [[header for _, header, _ in TABLE_COLUMNS]]
+    for row in rows:
+        cells.append([fmt.format(row[key]) for key, _, fmt in TABLE_COLUMNS])
+    widths = [max(len(line[i]) for line in cells) for i in range(len(TABLE_COLUMNS))]
+
+    print("-" * (sum(widths) + 2 * (len(widths) - 1)))
+    for n, line in enumerate(cells):
+        print("  ".join(cell.ljust(width) for cell, width in zip(line, widths)))
+        if n == 0:
+            print("-" * (sum(widths) + 2 * (len(widths) - 1)))
+    print("-" * (sum(widths) + 2 * (len(widths) - 1)))
+
+def write_csv(rows, output_path):
+    """Save the evaluation results as CSV"""
+    with open(output_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=[key for key, _, _ in TABLE_COLUMNS] + ['requests'])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: row[key] for key in writer.fieldnames})
+
+def parse_batch_size(value):
+    """Parse a batch size argument; 'auto' lets the packer fill the context window"""
+    return None if value == 'auto' else int(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare models, batch sizes and output formats on a labelled review set")
+    parser.add_argument("--file", required=True, help="Labelled review set (.xlsx or .csv)")
+    parser.add_argument("--api-key", default=os.environ.get('OPENROUTER_API_KEY', ''),
+                        help="OpenRouter API key (default: OPENROUTER_API_KEY)")
+    parser.add_argument("--models", default="microsoft/mai-ds-r1:free,thudm/glm-4-9b:free",
+                        help="Comma separated model IDs")
+    parser.add_argument("--batch-sizes", default="auto",
+                        help="Comma separated maximum reviews per request, or 'auto'")
+    parser.add_argument("--formats", default=DEFAULT_OUTPUT_FORMAT,
+                        help=f"Comma separated output formats ({', '.join(OUTPUT_FORMATS)})")
+    parser.add_argument("--replay", choices=model_replay.MODES, default=None,
+                        help="Record or replay model responses (default: MODEL_REPLAY_MODE)")
+    parser.add_argument("--archive", help="Replay archive to use")
+    parser.add_argument("--csv", help="Also write the results to this CSV file")
+
+    args = parser.parse_args()
+
+    if args.replay or args.archive:
+        model_replay.configure(args.replay or model_replay.get_mode(), args.archive)
+    if not args.api_key and model_replay.get_mode() != 'replay':
+        print("Error: provide --api-key or set OPENROUTER_API_KEY (not needed with --replay replay)")
+        sys.exit(1)
+
+    output_formats = args.formats.split(',')
+    unknown = [output_format for output_format in output_formats if output_format not in OUTPUT_FORMATS]
+    if unknown:
+        print(f"Error: unknown output format(s): {', '.join(unknown)}")
+        sys.exit(1)
+
+    loaded = load_labelled_reviews(args.file)
+    if not loaded or not loaded[0]:
+        print("No labelled reviews to evaluate")
+        sys.exit(1)
+    reviews, labels = loaded
+
+    models = args.models.split(',')
+    batch_sizes = [parse_batch_size(value) for value in args.batch_sizes.split(',')]
+    print(f"Evaluating {len(models) * len(batch_sizes) * len(output_formats)} configurations "
+          f"on {len(reviews)} labelled reviews ({labels.count('FAKE')} fake)")
+
+    try:
+        rows = run_sync(evaluate(reviews, labels, args.api_key, models, batch_sizes, output_formats))
+    except model_replay.ReplayMissError as e:
+        print(f"Error: {e}. Record the configurations again with --replay record")
+        sys.exit(1)
+
+    print()
+    print_table(rows)
+    if args.csv:
+        write_csv(rows, args.csv)
+        print(f"Results written to {args.csv}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import json
+import gzip
+import hashlib
+import threading
+
+# 'off' calls the model, 'record' calls it and saves every successful
+# response, 'replay' answers only from the archive and never touches the network
+MODES = ('off', 'record', 'replay')
+
+DEFAULT_ARCHIVE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_replay', 'responses.jsonl.gz')
+
+class ReplayMissError(Exception):
+    """Raised in replay mode when a request has no recorded response"""
+
+def payload_key(payload):
+    """
+    Hash a request payload into the key its response is stored under
+
+    Args:
+        payload: Request payload
+
+    Returns:
+        Hex digest of the canonical JSON form of the payload
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class ReplayArchive:
+    """
+    Gzip-compressed JSON lines file of model responses keyed by payload hash
+
+    Each recording is appended as its own gzip member, which gzip readers
+    treat as one continuous stream.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def _load(self):
+        """Read the archive into memory the first time it is needed"""
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                self.entries[entry['key']] = entry
+
+    def get(self, key):
+        """
+        Look up a recorded response
+
+        Args:
+            key: Payload hash
+
+        Returns:
+            Dictionary with 'status_code', 'response_text' and 'elapsed_time', or None
+        """
+        with self.lock:
+            self._load()
+            return self.entries.get(key)
+
+    def record(self, key, status_code, response_text, elapsed_time):
+        """Append a response to the archive"""
+        entry = {
+            'key': key,
+            'status_code': status_code,
+            'response_text': response_text,
+            'elapsed_time': elapsed_time
+        }
+        with self.lock:
+            self._load()
+            if key in self.entries:
+                return
+            self.entries[key] = entry
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+
+_mode = os.environ.get('MODEL_REPLAY_MODE', 'off').lower()
+if _mode not in MODES:
+    print(f"Warning: unknown MODEL_REPLAY_MODE '{_mode}', model calls will not be recorded or replayed")
+    _mode = 'off'
+_archive = ReplayArchive(os.environ.get('MODEL_REPLAY_ARCHIVE', DEFAULT_ARCHIVE))
+
+def configure(mode, archive_path=None):
+    """
+    Switch the record/replay mode, and optionally the archive, for this process
+
+    Args:
+        mode: One of MODES
+        archive_path: Optional path of the archive to use
+    """
+    global _mode, _archive
+    if mode not in MODES:
+        raise ValueError(f"Unknown replay mode '{mode}', expected one of {', '.join(MODES)}")
+    _mode = mode
+    if archive_path and archive_path != _archive.path:
+        _archive = ReplayArchive(archive_path)
+
+def get_mode():
+    """Get the current record/replay mode"""
+    return _mode
+
+def get_archive():
+    """Get the archive used for recording and replaying"""
+    return _archive
@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+import weakref
+import concurrent.futures
+import json
+import httpx
+import model_replay
+
+# OpenRouter API endpoint
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Maximum number of model requests in flight at once per event loop
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('OPENROUTER_MAX_CONCURRENCY', 16))
+
+# Seconds to wait for a completion before giving up
+REQUEST_TIMEOUT = float(os.environ.get('OPENROUTER_TIMEOUT', 300))
+
+# httpx clients and semaphores are bound to the event loop that created them,
+# so keep one of each per loop and let them go away with the loop
+_clients = weakref.WeakKeyDictionary()
+_semaphores = weakref.WeakKeyDictionary()
+
+class OpenRouterError(Exception):
+    """Raised when OpenRouter answers a streaming request with an error"""
+
+    def __init__(self, status_code, response_text):
+        super().__init__(f"Request failed with status code: {status_code}")
+        self.status_code = status_code
+        self.response_text = response_text
+
+def build_headers(api_key):
+    """Build the request headers for the OpenRouter API"""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+
+def get_async_client():
+    """
+    Get the shared connection pool for the running event loop
+
+    Returns:
+        An httpx.AsyncClient shared by every request made from this loop
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        limits = httpx.Limits(max_connections=MAX_CONCURRENT_REQUESTS,
+                              max_keepalive_connections=MAX_CONCURRENT_REQUESTS)
+        client = httpx.AsyncClient(limits=limits, timeout=REQUEST_TIMEOUT)
+        _clients[loop] = client
+    return client
+
+def get_semaphore():
+    """Get the semaphore that caps concurrent requests for the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        _semaphores[loop] = semaphore
+    return semaphore
+
+async def close_async_client():
+    """Close the shared connection pool for the running event loop"""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+def run_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code
+
+    The connection pool created for the temporary event loop is closed
+    before returning. When called from code that is already inside an
+    event loop (Jupyter, async frameworks), the coroutine runs on a helper
+    thread; async callers should await the *_async functions instead.
+
+    Args:
+        coro: Coroutine to run
+
+    Returns:
+        Whatever the coroutine returns
+    """
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_async_client()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(runner())
+
+    # asyncio.run refuses to nest inside a running loop
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, runner()).result()
+
+async def post_chat_completion(api_key, payload, client=None):
+    """
+    Send a chat completion request through the shared connection pool
+
+    In record mode successful responses are saved to the replay archive; in
+    replay mode they are served from it without any network access. Archive
+    reads and writes run on a worker thread so they never block the loop.
+
+    Args:
+        api_key: OpenRouter API key
+        payload: Request payload
+        client: Optional httpx.AsyncClient to use instead of the shared one
+
+    Returns:
+        Tuple of (status_code, response_text, elapsed_seconds)
+
+    Raises:
+        model_replay.ReplayMissError: in replay mode, if the request was never recorded
+    """
+    mode = model_replay.get_mode()
+    if mode != 'off':
+        key = model_replay.payload_key(payload)
+    if mode == 'replay':
+        entry = await asyncio.to_thread(model_replay.get_archive().get, key)
+        if entry is None:
+            raise model_replay.ReplayMissError(f"No recorded response for request {key[:12]}")
+        return entry['status_code'], entry['response_text'], entry['elapsed_time']
+
+    client = client or get_async_client()
+    async with get_semaphore():
+        start_time = time.time()
+        response = await client.post(OPENROUTER_URL, headers=build_headers(api_key), json=payload)
+        elapsed_time = time.time() - start_time
+
+    if mode == 'record' and response.status_code == 200:
+        await asyncio.to_thread(model_replay.get_archive().record, key, response.status_code,
+                                response.text, elapsed_time)
+    return response.status_code, response.text, elapsed_time
+
+async def stream_chat_completion(api_key, payload, client=None):
+    """
+    Send a chat completion request and yield the answer as it is generated
+
+    In record or replay mode the request is made without streaming so it
+    goes through the replay archive, and the whole answer arrives at once.
+
+    Args:
+        api_key: OpenRouter API key
+        payload: Request payload, without the 'stream' flag
+        client: Optional httpx.AsyncClient to use instead of the shared one
+
+    Yields:
+        Dictionaries with either a 'content' text delta, or the final 'usage'
+        and 'model' once the answer is complete
+
+    Raises:
+        OpenRouterError: if the request is rejected
+    """
+    if model_replay.get_mode() != 'off':
+        status_code, response_text, _ = await post_chat_completion(api_key, payload, client)
+        if status_code != 200:
+            raise OpenRouterError(status_code, response_text)
+        result = json.loads(response_text)
+        yield {'content': result["choices"][0]["message"]["content"]}
+        yield {'usage': result.get("usage") or {}, 'model': result.get("model")}
+        return
+
+    client = client or get_async_client()
+    usage = {}
+    model = None
+    async with get_semaphore():
+        async with client.stream("POST", OPENROUTER_URL, headers=build_headers(api_key),
+                                 json={**payload, "stream": True}) as response:
+            if response.status_code != 200:
+                raise OpenRouterError(response.status_code, (await response.aread()).decode('utf-8', errors='replace'))
+
+            # Server-sent events; lines starting with ':' are keep-alive comments
+            async for line in response.aiter_lines():
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    raise OpenRouterError(response.status_code, json.dumps(chunk["error"]))
+                model = chunk.get("model", model)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices", []):
+                    content = (choice.get("delta") or {}).get("content")
+                    if content:
+                        yield {'content': content}
+    yield {'usage': usage, 'model': model}
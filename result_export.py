@@ -0,0 +1,170 @@
+import os
+import threading
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+# Columns written for every analyzed review
+EXPORT_COLUMNS = [
+    'row', 'source', 'reviewer_name', 'star_rating', 'review_text',
+    'label', 'confidence', 'explanation', 'model', 'batch', 'latency_seconds'
+]
+
+# Columns added to the annotated copy of the input workbook
+ANNOTATION_COLUMNS = {
+    'label': 'AI Label',
+    'confidence': 'AI Confidence',
+    'explanation': 'AI Explanation',
+    'model': 'AI Model',
+    'latency_seconds': 'AI Latency (s)'
+}
+
+def _export_schema():
+    """Arrow schema of the per-review export"""
+    return pa.schema([
+        ('row', pa.int64()),
+        ('source', pa.string()),
+        ('reviewer_name', pa.string()),
+        ('star_rating', pa.string()),
+        ('review_text', pa.string()),
+        ('label', pa.string()),
+        ('confidence', pa.float64()),
+        ('explanation', pa.string()),
+        ('model', pa.string()),
+        ('batch', pa.int32()),
+        ('latency_seconds', pa.float64()),
+    ])
+
+def _to_confidence(value):
+    """Turn the model's confidence into a float between 0 and 1, or None"""
+    try:
+        confidence = float(value)
+    except (TypeError, ValueError):
+        return None
+    if confidence > 1:
+        # Some models answer in percent
+        confidence /= 100
+    return min(max(confidence, 0.0), 1.0)
+
+class ResultExporter:
+    """
+    Writes per-review verdicts to disk batch by batch as results arrive
+
+    The format is picked from each path's extension:
+    - .parquet: Parquet file, one row group per batch
+    - .arrow / .feather: Arrow IPC file, one record batch per batch
+    - .xlsx: copy of the input workbook with verdict columns added
+
+    Parquet and Arrow output never hold more than one batch in memory and
+    can be read back zero-copy (e.g. pyarrow.ipc.open_file with a memory map).
+    The annotated workbook is written when the exporter is closed.
+    write_batch may be called from several threads at once.
+    """
+
+    def __init__(self, export_paths, source_path, model_id):
+        if isinstance(export_paths, str):
+            export_paths = [export_paths]
+        self.source_path = source_path
+        self.source = os.path.basename(source_path)
+        self.model_id = model_id
+        self.batches_written = 0
+        self.rows_written = 0
+
+        self.arrow_writers = []
+        self.xlsx_paths = []
+        self.annotations = {}
+        self.lock = threading.Lock()
+
+        try:
+            for path in export_paths:
+                extension = os.path.splitext(path)[1].lower()
+                if extension == '.xlsx':
+                    self.xlsx_paths.append(path)
+                elif extension in ('.parquet', '.arrow', '.feather'):
+                    if pa is None:
+                        raise ImportError(f"Exporting to {extension} requires the pyarrow package")
+                    if extension == '.parquet':
+                        writer = pa.parquet.ParquetWriter(path, _export_schema())
+                    else:
+                        writer = pa.ipc.new_file(path, _export_schema())
+                    self.arrow_writers.append(writer)
+                else:
+                    raise ValueError(f"Unsupported export format '{extension}', use .parquet, .arrow, .feather or .xlsx")
+        except Exception:
+            # Don't leave the files opened so far without a footer
+            for writer in self.arrow_writers:
+                writer.close()
+            self.arrow_writers = []
+            raise
+
+    def write_batch(self, batch, analysis_result):
+        """
+        Write the verdicts for one analyzed batch
+
+        Args:
+            batch: List of (original_index, review_sent, original_review) tuples
+            analysis_result: Dictionary with analysis results for the batch, or None if it failed
+        """
+        with self.lock:
+            self._write_batch(batch, analysis_result)
+
+    def _write_batch(self, batch, analysis_result):
+        verdicts = {}
+        model = self.model_id
+        latency = None
+        if analysis_result:
+            model = analysis_result.get('model', model)
+            latency = analysis_result.get('usage', {}).get('elapsed_time')
+            for review in analysis_result.get('reviews', []):
+                if review.get('index') is not None:
+                    verdicts[review['index']] = review
+
+        self.batches_written += 1
+        rows = {column: [] for column in EXPORT_COLUMNS}
+        # Export the full review, not the truncated copy the model may have seen
+        for index, _, review in batch:
+            verdict = verdicts.get(index, {})
+            label = str(verdict.get('classification', '')).upper() or None
+            explanation = verdict.get('explanation')
+            values = {
+                'row': index,
+                'source': self.source,
+                'reviewer_name': str(review.get('reviewer_name', 'Anonymous')),
+                'star_rating': str(review.get('star_rating', 'N/A')),
+                'review_text': str(review.get('review_text', '')),
+                'label': label,
+                'confidence': _to_confidence(verdict.get('confidence')),
+                'explanation': str(explanation) if explanation is not None else None,
+                'model': model,
+                'batch': self.batches_written,
+                'latency_seconds': latency
+            }
+            for column in EXPORT_COLUMNS:
+                rows[column].append(values[column])
+            if self.xlsx_paths:
+                self.annotations[index] = {key: values[key] for key in ANNOTATION_COLUMNS}
+
+        if self.arrow_writers:
+            record_batch = pa.RecordBatch.from_pydict(rows, schema=_export_schema())
+            for writer in self.arrow_writers:
+                writer.write_batch(record_batch)
+        self.rows_written += len(batch)
+
+    def close(self):
+        """Finish the Arrow/Parquet files and write any annotated workbooks"""
+        for writer in self.arrow_writers:
+            writer.close()
+        self.arrow_writers = []
+
+        if self.xlsx_paths:
+            df = pd.read_excel(self.source_path)
+            for key, column in ANNOTATION_COLUMNS.items():
+                df[column] = [self.annotations.get(i, {}).get(key) for i in range(len(df))]
+            for path in self.xlsx_paths:
+                df.to_excel(path, index=False)
+            self.annotations = {}
@@ -1,8 +1,12 @@
 import pandas as pd
 import os
 import json
-import requests
-import time
+import asyncio
+import model_replay
+from openrouter_client import post_chat_completion, run_sync
+from token_budget import estimate_tokens, pack_reviews, review_cost, review_line
+from review_index import get_default_index
+from result_export import ResultExporter
 
 def read_excel_file(file_path):
     """
@@ -21,27 +25,39 @@ def read_excel_file(file_path):
         print(f"Error reading file {file_path}: {str(e)}")
         return None
 
-def analyze_reviews_with_ai(reviews, api_key, model_id="microsoft/mai-ds-r1:free"):
+# How the model is asked to report each review. "json" echoes the review
+# text back; "compact" leaves it out, which saves output tokens.
+OUTPUT_FORMATS = {
+    "json": """
+            {
+                "review_number": the number of the review,
+                "review_text": "The original review text",
+                "classification": "REAL or FAKE",
+                "confidence": a number between 0 and 1,
+                "explanation": "Brief explanation for the classification"
+            },""",
+    "compact": """
+            {
+                "review_number": the number of the review,
+                "classification": "REAL or FAKE",
+                "confidence": a number between 0 and 1,
+                "explanation": "Brief explanation for the classification"
+            },"""
+}
+
+DEFAULT_OUTPUT_FORMAT = "json"
+
+def build_prompt(reviews, output_format=DEFAULT_OUTPUT_FORMAT):
     """
-    Analyze reviews using AI to detect fake reviews
+    Build the fake review detection prompt for a list of reviews
     
     Args:
         reviews: List of reviews to analyze
-        api_key: OpenRouter API key
-        model_id: ID of the model to use
+        output_format: Key of OUTPUT_FORMATS describing the expected answer
         
     Returns:
-        Dictionary with analysis results
+        Prompt text
     """
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
-    
-    # OpenRouter API endpoint
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    
-    # Create a prompt for the AI
     prompt = """
     You are an expert at detecting fake product reviews. Analyze the following reviews and determine which ones are likely fake.
     
@@ -53,16 +69,11 @@ def analyze_reviews_with_ai(reviews, api_key, model_id="microsoft/mai-ds-r1:free
     5. Unrealistic claims about product benefits
     6. Very short reviews with extreme ratings (1 or 5 stars)
     
-    For each review, classify it as "REAL" or "FAKE" and provide a brief explanation.
+    For each review, classify it as "REAL" or "FAKE", say how confident you are, and provide a brief explanation.
     
     Format your response as a JSON object with the following structure:
     {
-        "reviews": [
-            {
-                "review_text": "The original review text",
-                "classification": "REAL or FAKE",
-                "explanation": "Brief explanation for the classification"
-            },
+        "reviews": [""" + OUTPUT_FORMATS[output_format] + """
             ...
         ],
         "summary": {
@@ -78,74 +89,289 @@ def analyze_reviews_with_ai(reviews, api_key, model_id="microsoft/mai-ds-r1:free
     
     # Add the reviews to the prompt
     for i, review in enumerate(reviews):
-        reviewer = review.get('reviewer_name', 'Anonymous')
-        rating = review.get('star_rating', 'N/A')
-        text = review.get('review_text', '')
-        prompt += f"\nReview #{i+1} - Reviewer: {reviewer}, Rating: {rating} stars\n{text}\n"
+        prompt += review_line(i + 1, review)
+    
+    return prompt
+
+def parse_analysis_response(status_code, response_text, elapsed_time):
+    """
+    Parse a raw OpenRouter response into an analysis result
+    
+    Args:
+        status_code: HTTP status code of the response
+        response_text: Raw response body
+        elapsed_time: Seconds the request took
+        
+    Returns:
+        Dictionary with analysis results, or None if the response is unusable.
+        The model that answered is added under 'model', token usage and
+        timing under 'usage'.
+    """
+    if status_code != 200:
+        print(f"Request failed with status code: {status_code}")
+        print(f"Response: {response_text}")
+        return None
+    
+    result = json.loads(response_text)
+    # Extract the model's response
+    if "choices" not in result or len(result["choices"]) == 0:
+        print(f"Unexpected response format: {result}")
+        return None
+    
+    message = result["choices"][0]["message"]["content"]
+    model_used = result.get("model", "Unknown model")
+    print(f"\nResponse received from {model_used} (took {elapsed_time:.2f} seconds)")
+    
+    # Parse the JSON response
+    try:
+        # Find JSON content in the response (it might be wrapped in markdown code blocks)
+        json_start = message.find('{')
+        json_end = message.rfind('}') + 1
+        if json_start >= 0 and json_end > json_start:
+            json_content = message[json_start:json_end]
+            analysis_result = json.loads(json_content)
+        else:
+            print("Could not find JSON content in the response")
+            return None
+    except json.JSONDecodeError as e:
+        print(f"Error parsing JSON response: {str(e)}")
+        print("Raw response:", message)
+        return None
+    
+    if not isinstance(analysis_result, dict):
+        print("Unexpected analysis format in the response")
+        return None
+    
+    usage = result.get("usage") or {}
+    analysis_result['model'] = model_used
+    analysis_result['usage'] = {
+        'requests': 1,
+        'failed_requests': 0,
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', estimate_tokens(message)),
+        'elapsed_time': elapsed_time,
+        'request_time': elapsed_time
+    }
+    return analysis_result
+
+def attach_review_positions(analysis_result, batch):
+    """
+    Link each analyzed review back to the review it describes
     
+    Sets 'index' to the position of the review in the original input and
+    fills in the full 'review_text' when the model did not echo it or was
+    only sent a truncated copy.
+    
+    Args:
+        analysis_result: Dictionary with analysis results for one batch
+        batch: List of (original_index, review_sent, original_review) tuples
+    """
+    analyzed = analysis_result.get('reviews')
+    if not isinstance(analyzed, list):
+        analysis_result['reviews'] = []
+        return
+    
+    for position, review in enumerate(analyzed):
+        if not isinstance(review, dict):
+            continue
+        try:
+            number = int(review.get('review_number'))
+        except (TypeError, ValueError):
+            # Fall back to the order of the answers when it matches the input
+            number = position + 1 if len(analyzed) == len(batch) else None
+        if number is None or not 1 <= number <= len(batch):
+            continue
+        original_index, sent, original = batch[number - 1]
+        review['index'] = original_index
+        if not review.get('review_text') or sent is not original:
+            review['review_text'] = str(original.get('review_text', ''))
+    
+    analysis_result['reviews'] = [review for review in analyzed if isinstance(review, dict)]
+
+async def analyze_batch_async(batch, api_key, model_id="microsoft/mai-ds-r1:free", client=None,
+                              output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    Send one request analyzing a batch of reviews that fits in the model's context
+    
+    Args:
+        batch: List of (original_index, review_sent, original_review) tuples to analyze
+        api_key: OpenRouter API key
+        model_id: ID of the model to use
+        client: Optional httpx.AsyncClient to use instead of the shared pool
+        output_format: Key of OUTPUT_FORMATS describing the expected answer
+        
+    Returns:
+        Dictionary with analysis results
+    """
     # Request payload
     payload = {
         "model": model_id,
         "messages": [
-            {"role": "user", "content": prompt}
+            {"role": "user", "content": build_prompt([review for _, review, _ in batch], output_format)}
         ]
     }
     
     print(f"Sending request to {model_id}...")
-    start_time = time.time()
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        
-        if response.status_code == 200:
-            result = response.json()
-            # Extract the model's response
-            if "choices" in result and len(result["choices"]) > 0:
-                message = result["choices"][0]["message"]["content"]
-                model_used = result.get("model", "Unknown model")
-                print(f"\nResponse received from {model_used} (took {elapsed_time:.2f} seconds)")
-                
-                # Parse the JSON response
-                try:
-                    # Find JSON content in the response (it might be wrapped in markdown code blocks)
-                    json_start = message.find('{')
-                    json_end = message.rfind('}') + 1
-                    if json_start >= 0 and json_end > json_start:
-                        json_content = message[json_start:json_end]
-                        analysis_result = json.loads(json_content)
-                        return analysis_result
-                    else:
-                        print("Could not find JSON content in the response")
-                        return None
-                except json.JSONDecodeError as e:
-                    print(f"Error parsing JSON response: {str(e)}")
-                    print("Raw response:", message)
-                    return None
-            else:
-                print(f"Unexpected response format: {result}")
-                return None
-        else:
-            print(f"Request failed with status code: {response.status_code}")
-            print(f"Response: {response.text}")
-            return None
+        status_code, response_text, elapsed_time = await post_chat_completion(api_key, payload, client)
+        analysis_result = parse_analysis_response(status_code, response_text, elapsed_time)
+    except model_replay.ReplayMissError:
+        # A replay run must cover every request, not silently score a subset
+        raise
     except Exception as e:
         print(f"Error occurred: {str(e)}")
         return None
+    
+    if analysis_result:
+        attach_review_positions(analysis_result, batch)
+    return analysis_result
 
-def process_excel_file(file_path, api_key, model_id="microsoft/mai-ds-r1:free"):
+def merge_analysis_results(results):
     """
-    Process an Excel file containing reviews
+    Combine the analysis results of several batches into one
     
     Args:
-        file_path: Path to the Excel file
+        results: List of analysis results; failed batches are None
+        
+    Returns:
+        Dictionary with analysis results, or None if every batch failed.
+        'incomplete' is True and usage['failed_requests'] counts the failed
+        batches when only some of them succeeded.
+    """
+    succeeded = [result for result in results if result]
+    if not succeeded:
+        return None
+    if len(results) == 1:
+        return succeeded[0]
+    
+    if len(succeeded) < len(results):
+        print(f"Warning: {len(results) - len(succeeded)} of {len(results)} batches failed")
+    
+    merged_reviews = []
+    real_count = 0
+    fake_count = 0
+    usage = {
+        'requests': len(results),
+        'failed_requests': len(results) - len(succeeded),
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'elapsed_time': 0,
+        'request_time': 0
+    }
+    for result in succeeded:
+        merged_reviews.extend(result.get('reviews', []))
+        stats = get_review_stats(result)
+        real_count += stats['real']
+        fake_count += stats['fake']
+        batch_usage = result.get('usage', {})
+        usage['prompt_tokens'] += batch_usage.get('prompt_tokens', 0)
+        usage['completion_tokens'] += batch_usage.get('completion_tokens', 0)
+        usage['request_time'] += batch_usage.get('request_time', 0)
+        # Batches run concurrently, so the slowest one bounds the wall time
+        usage['elapsed_time'] = max(usage['elapsed_time'], batch_usage.get('elapsed_time', 0))
+    
+    return {
+        'reviews': merged_reviews,
+        'summary': {
+            'total_reviews': real_count + fake_count,
+            'real_reviews': real_count,
+            'fake_reviews': fake_count
+        },
+        # Stats only cover the batches that succeeded
+        'incomplete': usage['failed_requests'] > 0,
+        'usage': usage
+    }
+
+async def analyze_reviews_async(reviews, api_key, model_id="microsoft/mai-ds-r1:free", client=None,
+                                output_format=DEFAULT_OUTPUT_FORMAT, max_batch_reviews=None, on_batch=None):
+    """
+    Analyze reviews using AI to detect fake reviews, without blocking the event loop
+    
+    Reviews are packed into as few requests as fit in the model's context
+    window, and the requests run concurrently over the shared connection pool.
+    
+    Args:
+        reviews: List of reviews to analyze
         api_key: OpenRouter API key
         model_id: ID of the model to use
+        client: Optional httpx.AsyncClient to use instead of the shared pool
+        output_format: Key of OUTPUT_FORMATS describing the expected answer
+        max_batch_reviews: Optional cap on the number of reviews per request
+        on_batch: Optional callback called as on_batch(batch, analysis_result)
+            in a worker thread as soon as each request finishes; analysis_result
+            is None if it failed
         
     Returns:
         Dictionary with analysis results
     """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}', expected one of {', '.join(OUTPUT_FORMATS)}")
+    
+    if not reviews:
+        return await analyze_batch_async([], api_key, model_id, client, output_format)
+    
+    prompt_tokens = estimate_tokens(build_prompt([], output_format))
+    batches = pack_reviews(reviews, model_id, prompt_tokens, echo_text=(output_format == "json"),
+                           max_reviews=max_batch_reviews)
+    if len(batches) > 1:
+        print(f"Splitting {len(reviews)} reviews into {len(batches)} requests for {model_id}")
+    
+    async def run_batch(batch):
+        analysis_result = await analyze_batch_async(batch, api_key, model_id, client, output_format)
+        if on_batch is not None:
+            # Exporters write to disk, keep that off the event loop
+            await asyncio.to_thread(on_batch, batch, analysis_result)
+        return analysis_result
+    
+    results = await asyncio.gather(*(run_batch(batch) for batch in batches))
+    return merge_analysis_results(results)
+
+def estimate_analysis_tokens(reviews, output_format=DEFAULT_OUTPUT_FORMAT):
+    """
+    Estimate how many tokens analyzing a list of reviews will use
+    
+    Args:
+        reviews: List of reviews to analyze
+        output_format: Key of OUTPUT_FORMATS describing the expected answer
+        
+    Returns:
+        Estimated input plus output tokens
+    """
+    echo_text = output_format == "json"
+    total = estimate_tokens(build_prompt([], output_format))
+    for review in reviews:
+        total += sum(review_cost(review, echo_text))
+    return total
+
+def analyze_reviews_with_ai(reviews, api_key, model_id="microsoft/mai-ds-r1:free",
+                            output_format=DEFAULT_OUTPUT_FORMAT, max_batch_reviews=None):
+    """
+    Analyze reviews using AI to detect fake reviews
+    
+    Args:
+        reviews: List of reviews to analyze
+        api_key: OpenRouter API key
+        model_id: ID of the model to use
+        output_format: Key of OUTPUT_FORMATS describing the expected answer
+        max_batch_reviews: Optional cap on the number of reviews per request
+        
+    Returns:
+        Dictionary with analysis results
+    """
+    return run_sync(analyze_reviews_async(reviews, api_key, model_id, output_format=output_format,
+                                          max_batch_reviews=max_batch_reviews))
+
+def load_reviews(file_path):
+    """
+    Read an Excel file into the list of review dictionaries used by the analyzer
+    
+    Args:
+        file_path: Path to the Excel file
+        
+    Returns:
+        List of reviews, or None if the file could not be read
+    """
     # Read the Excel file
     df = read_excel_file(file_path)
     if df is None:
@@ -161,11 +387,121 @@ def process_excel_file(file_path, api_key, model_id="microsoft/mai-ds-r1:free"):
         }
         reviews.append(review)
     
+    return reviews
+
+def index_reviews(reviews, analysis_result, file_path):
+    """
+    Add analyzed reviews to the similarity index
+    
+    Args:
+        reviews: List of reviews that were analyzed
+        analysis_result: Dictionary with analysis results
+        file_path: Path of the file the reviews came from
+    """
+    index = get_default_index()
+    if index is None:
+        return
+    
+    classifications = {}
+    for review in analysis_result.get('reviews', []):
+        classifications[str(review.get('review_text', ''))] = review.get('classification', '').upper() or None
+    
+    try:
+        index.add_reviews(reviews, os.path.basename(file_path), classifications)
+    except Exception as e:
+        print(f"Error indexing reviews: {str(e)}")
+
+async def process_file_async(file_path, api_key, model_id="microsoft/mai-ds-r1:free", client=None,
+                             export_path=None):
+    """
+    Process an Excel file containing reviews, without blocking the event loop
+    
+    Args:
+        file_path: Path to the Excel file
+        api_key: OpenRouter API key
+        model_id: ID of the model to use
+        client: Optional httpx.AsyncClient to use instead of the shared pool
+        export_path: Optional path, or list of paths, to write per-review verdicts
+            to as each batch finishes (.parquet, .arrow, .feather or .xlsx)
+        
+    Returns:
+        Dictionary with analysis results
+    """
+    # Reading the workbook is blocking, so keep it off the event loop
+    reviews = await asyncio.to_thread(load_reviews, file_path)
+    if reviews is None:
+        return None
+    
+    return await process_reviews_async(reviews, file_path, api_key, model_id, client, export_path)
+
+async def process_reviews_async(reviews, file_path, api_key, model_id="microsoft/mai-ds-r1:free", client=None,
+                                export_path=None):
+    """
+    Analyze reviews already read from an Excel file, then export and index them
+    
+    Args:
+        reviews: Reviews returned by load_reviews(file_path)
+        file_path: Path of the Excel file the reviews came from
+        api_key: OpenRouter API key
+        model_id: ID of the model to use
+        client: Optional httpx.AsyncClient to use instead of the shared pool
+        export_path: Optional path, or list of paths, to write per-review verdicts
+            to as each batch finishes (.parquet, .arrow, .feather or .xlsx)
+        
+    Returns:
+        Dictionary with analysis results
+    """
+    exporter = ResultExporter(export_path, file_path, model_id) if export_path else None
+    
     # Analyze the reviews
-    analysis_result = analyze_reviews_with_ai(reviews, api_key, model_id)
+    try:
+        analysis_result = await analyze_reviews_async(
+            reviews, api_key, model_id, client,
+            on_batch=exporter.write_batch if exporter else None
+        )
+    finally:
+        if exporter:
+            await asyncio.to_thread(exporter.close)
+    
+    # Make the reviews searchable with /api/similar; replay runs leave local state alone
+    if analysis_result and model_replay.get_mode() != 'replay':
+        await asyncio.to_thread(index_reviews, reviews, analysis_result, file_path)
     
     return analysis_result
 
+async def process_files_async(file_paths, api_key, model_id="microsoft/mai-ds-r1:free", client=None):
+    """
+    Process several Excel files concurrently over one connection pool
+    
+    Args:
+        file_paths: List of paths to Excel files
+        api_key: OpenRouter API key
+        model_id: ID of the model to use
+        client: Optional httpx.AsyncClient to use instead of the shared pool
+        
+    Returns:
+        List of analysis results, in the same order as file_paths
+    """
+    return await asyncio.gather(*(
+        process_file_async(file_path, api_key, model_id, client) for file_path in file_paths
+    ))
+
+def process_excel_file(file_path, api_key, model_id="microsoft/mai-ds-r1:free", export_path=None):
+    """
+    Process an Excel file containing reviews
+    
+    Args:
+        file_path: Path to the Excel file
+        api_key: OpenRouter API key
+        model_id: ID of the model to use
+        export_path: Optional path, or list of paths, to write per-review verdicts
+            to as each batch finishes (.parquet, .arrow, .feather or .xlsx)
+        
+    Returns:
+        Dictionary with analysis results
+    """
+    return run_sync(process_file_async(file_path, api_key, model_id, export_path=export_path))
+
 def get_fake_reviews_list(analysis_result):
     """
     Extract the list of fake reviews from the analysis result
@@ -221,15 +557,22 @@ def get_review_stats(analysis_result):
 if __name__ == "__main__":
     import sys
     
-    if len(sys.argv) < 3:
-        print("Usage: python review_analyzer.py <excel_file_path> <api_key> [model_id]")
+    # Everything after --export is a path to write per-review verdicts to
+    args = sys.argv[1:]
+    export_paths = []
+    if '--export' in args:
+        export_paths = args[args.index('--export') + 1:]
+        args = args[:args.index('--export')]
+    
+    if len(args) < 2:
+        print("Usage: python review_analyzer.py <excel_file_path> <api_key> [model_id] [--export <path> ...]")
         sys.exit(1)
     
-    file_path = sys.argv[1]
-    api_key = sys.argv[2]
-    model_id = sys.argv[3] if len(sys.argv) > 3 else "microsoft/mai-ds-r1:free"
+    file_path = args[0]
+    api_key = args[1]
+    model_id = args[2] if len(args) > 2 else "microsoft/mai-ds-r1:free"
     
-    result = process_excel_file(file_path, api_key, model_id)
+    result = process_excel_file(file_path, api_key, model_id, export_paths or None)
     
     if result:
         # Print statistics
@@ -0,0 +1,372 @@
+import os
+import re
+import json
+import math
+import zlib
+import hashlib
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+from numpy.lib.format import open_memmap
+
+# Where the index lives; set REVIEW_INDEX_DIR to an empty string to disable indexing
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'review_index')
+INDEX_DIR = os.environ.get('REVIEW_INDEX_DIR', DEFAULT_INDEX_DIR)
+
+# Number of hashed TF-IDF features per review
+DIMENSIONS = 512
+
+# Locality-sensitive hashing: NUM_TABLES independent hash tables, each
+# bucketing rows by the signs of NUM_PLANES random hyperplanes. More tables
+# find more true neighbours at the cost of more candidates to score.
+NUM_PLANES = 12
+NUM_TABLES = 8
+
+# Rows allocated when the index is created; the matrix doubles when it fills up
+INITIAL_CAPACITY = 1024
+
+# Indexes up to this size are always searched exactly
+EXACT_SCAN_ROWS = 5000
+
+# Bumped when the on-disk vector format changes; older indexes are rebuilt
+INDEX_VERSION = 3
+
+_WORD_PATTERN = re.compile(r"[a-z0-9']+")
+
+def review_id(review):
+    """
+    Build a stable id for a review from its content
+
+    Args:
+        review: Review dictionary
+
+    Returns:
+        Hex id string
+    """
+    key = f"{review.get('reviewer_name', '')}\x1f{review.get('star_rating', '')}\x1f{review.get('review_text', '')}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def hashed_features(text):
+    """
+    Hash the words and word pairs of a text into feature counts
+
+    Args:
+        text: Review text
+
+    Returns:
+        Dictionary mapping feature index to signed count
+    """
+    words = _WORD_PATTERN.findall(str(text).lower())
+    terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    features = defaultdict(float)
+    for term, count in Counter(terms).items():
+        hashed = zlib.crc32(term.encode('utf-8'))
+        sign = 1.0 if hashed & 0x80000000 else -1.0
+        # Sublinear term frequency
+        features[hashed % DIMENSIONS] += sign * (1.0 + math.log(count))
+    return features
+
+class ReviewIndex:
+    """
+    Similarity index over every review analyzed so far
+
+    Normalized hashed term frequency vectors are kept in a memory-mapped
+    NumPy matrix, and IDF weights from the current document frequencies are
+    applied at query time, so old and new rows are always scored alike.
+    Random hyperplane signatures of the term frequency vectors bucket rows
+    in several hash tables for approximate nearest neighbour lookups; the
+    query's bucket and its one-bit neighbours are probed in every table.
+    Candidates are re-ranked with the exact TF-IDF cosine, and the whole
+    matrix is scanned when the index is small or the buckets hold fewer
+    than k candidates.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        self.lock = threading.Lock()
+        os.makedirs(index_dir, exist_ok=True)
+
+        self.vectors_path = os.path.join(index_dir, 'vectors.npy')
+        self.signatures_path = os.path.join(index_dir, 'signatures.npy')
+        self.metadata_path = os.path.join(index_dir, 'metadata.jsonl')
+        self.state_path = os.path.join(index_dir, 'state.json')
+
+        # Fixed seed so signatures stay comparable across runs
+        rng = np.random.default_rng(0)
+        self.planes = rng.standard_normal((DIMENSIONS, NUM_TABLES * NUM_PLANES)).astype(np.float32)
+        self.bit_weights = (1 << np.arange(NUM_PLANES)).astype(np.uint32)
+
+        self.metadata = []
+        self.rows_by_id = {}
+        self.buckets = [defaultdict(list) for _ in range(NUM_TABLES)]
+        self._weights_cache = None
+        self._load()
+
+    def _load(self):
+        """Open the on-disk index, creating it if needed"""
+        rebuild = False
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                state = json.load(f)
+            self.count = state['count']
+            rebuild = state.get('version') != INDEX_VERSION
+            self.document_frequency = np.array(state['document_frequency'], dtype=np.float64)
+            self.vectors = open_memmap(self.vectors_path, mode='r+')
+            self.signatures = open_memmap(self.signatures_path, mode='r+')
+            with open(self.metadata_path, encoding='utf-8') as f:
+                for line in f:
+                    self.metadata.append(json.loads(line))
+            # Drop rows written after the last saved state
+            if len(self.metadata) > self.count:
+                self.metadata = self.metadata[:self.count]
+                with open(self.metadata_path, 'w', encoding='utf-8') as f:
+                    for meta in self.metadata:
+                        f.write(json.dumps(meta) + '\n')
+        else:
+            self.count = 0
+            self.document_frequency = np.zeros(DIMENSIONS, dtype=np.float64)
+            self.vectors = open_memmap(self.vectors_path, mode='w+', dtype=np.float32,
+                                       shape=(INITIAL_CAPACITY, DIMENSIONS))
+            self.signatures = open_memmap(self.signatures_path, mode='w+', dtype=np.uint32,
+                                          shape=(INITIAL_CAPACITY, NUM_TABLES))
+            open(self.metadata_path, 'w').close()
+
+        if rebuild:
+            # Older indexes stored IDF-weighted vectors and a single hash table;
+            # recompute both from the texts
+            if self.signatures.shape[1:] != (NUM_TABLES,):
+                self.signatures = None
+                self.signatures = open_memmap(self.signatures_path, mode='w+', dtype=np.uint32,
+                                              shape=(self.vectors.shape[0], NUM_TABLES))
+            for row, meta in enumerate(self.metadata):
+                vector = self.vectorize(meta['review_text'])
+                self.vectors[row] = vector
+                self.signatures[row] = self.signature(vector)
+            self._save_state()
+
+        signatures = np.array(self.signatures[:self.count]).tolist()
+        for row, meta in enumerate(self.metadata):
+            self.rows_by_id[meta['id']] = row
+            for table, signature in enumerate(signatures[row]):
+                self.buckets[table][signature].append(row)
+
+    def _save_state(self):
+        """Flush the matrices and record how many rows are valid"""
+        self.vectors.flush()
+        self.signatures.flush()
+        with open(self.state_path + '.tmp', 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'count': self.count,
+                       'document_frequency': self.document_frequency.tolist()}, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def _grow(self, needed):
+        """Double the capacity of the on-disk matrices until needed rows fit"""
+        capacity = self.vectors.shape[0]
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+
+        for name in ('vectors', 'signatures'):
+            old = getattr(self, name)
+            path = getattr(self, f'{name}_path')
+            new = open_memmap(path + '.tmp', mode='w+', dtype=old.dtype, shape=(capacity,) + old.shape[1:])
+            new[:self.count] = old[:self.count]
+            new.flush()
+            del new, old
+            setattr(self, name, None)
+            os.replace(path + '.tmp', path)
+            setattr(self, name, open_memmap(path, mode='r+'))
+
+    def vectorize(self, text):
+        """
+        Turn a text into a normalized hashed term frequency vector
+
+        Args:
+            text: Review text
+
+        Returns:
+            float32 vector of length DIMENSIONS
+        """
+        vector = np.zeros(DIMENSIONS, dtype=np.float32)
+        for feature, weight in hashed_features(text).items():
+            vector[feature] = weight
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+    def _weights(self):
+        """
+        IDF weights and the TF-IDF norm of every row, for the current contents
+
+        Returns:
+            Tuple of (idf vector, squared idf vector, row norms)
+        """
+        if self._weights_cache is None or self._weights_cache[0] != self.count:
+            idf = (np.log((1 + self.count) / (1 + self.document_frequency)) + 1).astype(np.float32)
+            idf_squared = idf * idf
+            # einsum avoids materializing a weighted copy of the whole matrix
+            rows = self.vectors[:self.count]
+            norms = np.sqrt(np.einsum('ij,ij,j->i', rows, rows, idf_squared))
+            self._weights_cache = (self.count, idf, idf_squared, norms)
+        return self._weights_cache[1:]
+
+    def _score(self, rows, query):
+        """
+        TF-IDF cosine similarity between a query and some rows
+
+        Args:
+            rows: Array of row numbers, or a slice; a slice reads the memory
+                map in place instead of copying the selected rows
+            query: Term frequency vector of the query
+
+        Returns:
+            float32 array of scores, one per selected row
+        """
+        idf, idf_squared, norms = self._weights()
+        query_norm = np.linalg.norm(query * idf)
+        row_norms = norms[rows] * query_norm
+        dots = self.vectors[rows] @ (query * idf_squared)
+        return np.divide(dots, row_norms, out=np.zeros_like(dots), where=row_norms > 0)
+
+    def signature(self, vector):
+        """Compute the hyperplane bucket of a vector in every hash table"""
+        bits = ((vector @ self.planes) > 0).reshape(NUM_TABLES, NUM_PLANES)
+        return bits.astype(np.uint32) @ self.bit_weights
+
+    def add_reviews(self, reviews, source=None, classifications=None):
+        """
+        Add reviews to the index, skipping ones that are already in it
+
+        Args:
+            reviews: List of review dictionaries
+            source: Optional name of the file the reviews came from
+            classifications: Optional dictionary mapping review text to REAL/FAKE
+
+        Returns:
+            Number of reviews added
+        """
+        classifications = classifications or {}
+        with self.lock:
+            new_reviews = []
+            seen = set()
+            for review in reviews:
+                rid = review_id(review)
+                if rid in self.rows_by_id or rid in seen:
+                    continue
+                seen.add(rid)
+                new_reviews.append((rid, review))
+            if not new_reviews:
+                return 0
+
+            # Update document frequencies first so new vectors see their own terms
+            for _, review in new_reviews:
+                features = hashed_features(review.get('review_text', ''))
+                self.document_frequency[list(features)] += 1
+
+            self._grow(self.count + len(new_reviews))
+            with open(self.metadata_path, 'a', encoding='utf-8') as f:
+                for rid, review in new_reviews:
+                    text = str(review.get('review_text', ''))
+                    vector = self.vectorize(text)
+                    row = self.count
+                    self.vectors[row] = vector
+                    signature = self.signature(vector)
+                    self.signatures[row] = signature
+
+                    meta = {
+                        'id': rid,
+                        'review_text': text,
+                        'reviewer_name': str(review.get('reviewer_name', 'Anonymous')),
+                        'star_rating': str(review.get('star_rating', 'N/A')),
+                        'source': source,
+                        'classification': classifications.get(text)
+                    }
+                    f.write(json.dumps(meta) + '\n')
+                    self.metadata.append(meta)
+                    self.rows_by_id[rid] = row
+                    for table, bucket in enumerate(signature.tolist()):
+                        self.buckets[table][bucket].append(row)
+                    self.count += 1
+
+            self._save_state()
+            return len(new_reviews)
+
+    def _candidates(self, signatures):
+        """Rows in the query's bucket, or one bit away from it, in any hash table"""
+        rows = []
+        for table, signature in enumerate(signatures.tolist()):
+            buckets = self.buckets[table]
+            rows.extend(buckets.get(signature, ()))
+            for bit in range(NUM_PLANES):
+                rows.extend(buckets.get(signature ^ (1 << bit), ()))
+        return np.unique(np.array(rows, dtype=np.int64))
+
+    def search(self, text=None, rid=None, k=10):
+        """
+        Find the reviews most similar to a text or to an indexed review
+
+        Args:
+            text: Query review text
+            rid: Id of an indexed review to use as the query instead of text
+            k: Number of neighbours to return
+
+        Returns:
+            List of review metadata dictionaries with a 'score', best first,
+            or None if rid is not in the index
+        """
+        with self.lock:
+            exclude = None
+            if rid is not None:
+                exclude = self.rows_by_id.get(rid)
+                if exclude is None:
+                    return None
+                query = np.array(self.vectors[exclude])
+            else:
+                query = self.vectorize(text or '')
+
+            if self.count == 0 or not query.any():
+                return []
+
+            rows = None
+            if self.count > EXACT_SCAN_ROWS:
+                rows = self._candidates(self.signature(query))
+                if exclude is not None:
+                    rows = rows[rows != exclude]
+                if len(rows) < k:
+                    rows = None
+
+            if rows is None:
+                # Small index or too few candidates: score every row in place
+                rows = np.arange(self.count)
+                scores = self._score(slice(0, self.count), query)
+                if exclude is not None:
+                    scores[exclude] = -np.inf
+            else:
+                scores = self._score(rows, query)
+
+            k = min(k, self.count - (exclude is not None))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [dict(self.metadata[rows[i]], score=round(float(scores[i]), 4)) for i in top]
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+def get_default_index():
+    """
+    Get the shared index stored in INDEX_DIR
+
+    Returns:
+        ReviewIndex, or None if indexing is disabled
+    """
+    global _default_index
+    if not INDEX_DIR:
+        return None
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = ReviewIndex(INDEX_DIR)
+    return _default_index
@@ -1,9 +1,29 @@
 import os
 import sys
-import subprocess
 import time
-import signal
+import asyncio
 import platform
+from datetime import datetime
+
+# Ports the children are expected to listen on once they are ready
+API_PORT = int(os.environ.get('PORT', 8000))
+FRONTEND_PORT = 3000
+
+# How long startup waits for a child to open its port before giving up
+READY_TIMEOUT = 60
+
+# Restart backoff for crashed children (seconds)
+RESTART_BACKOFF_INITIAL = 1
+RESTART_BACKOFF_MAX = 30
+MAX_RESTARTS = 5
+
+# Output is read in chunks of this size; longer lines are printed in pieces
+READ_CHUNK_SIZE = 64 * 1024
+MAX_LINE_LENGTH = 1024 * 1024
+
+# A child that stays up this long is considered healthy again and its
+# restart counter and backoff are reset
+STABLE_RUNTIME = 60
 
 def check_api_key():
     """Check if the OpenRouter API key is set"""
@@ -15,100 +35,217 @@ def check_api_key():
         return False
     return True
 
-def start_processes():
-    """Start both the API server and the frontend"""
-    print("Starting FakeDetector application...")
-    
-    # Check if the API key is set
-    if not check_api_key():
-        return
-    
+def log_line(name, line):
+    """Print a single line of child output with a timestamp and name prefix"""
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"{timestamp} [{name}] {line}", flush=True)
+
+async def pump_output(name, stream):
+    """
+    Copy a child's output to our stdout line by line
+
+    Each child gets its own reader task, so a quiet process never holds up
+    the other one and its pipe is always drained. The pipe is read in
+    chunks rather than with readline(), so a very long line cannot stop
+    the reader; lines over MAX_LINE_LENGTH are printed in pieces.
+
+    Args:
+        name: Prefix to show in front of each line
+        stream: asyncio StreamReader attached to the child's stdout
+    """
+    buffer = b''
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        while len(buffer) > MAX_LINE_LENGTH:
+            lines.append(buffer[:MAX_LINE_LENGTH])
+            buffer = buffer[MAX_LINE_LENGTH:]
+        for line in lines:
+            log_line(name, line.decode('utf-8', errors='replace').rstrip())
+    if buffer:
+        log_line(name, buffer.decode('utf-8', errors='replace').rstrip())
+
+async def wait_for_port(port, timeout=READY_TIMEOUT, host='127.0.0.1', process=None):
+    """
+    Wait until something accepts TCP connections on a port
+
+    Args:
+        port: Port to probe
+        timeout: Maximum number of seconds to wait, or None to wait as long
+            as the process is running
+        host: Host to probe
+        process: Optional child process; stop waiting early if it exits
+
+    Returns:
+        True if the port became reachable, False otherwise
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while deadline is None or time.monotonic() < deadline:
+        if process is not None and process.returncode is not None:
+            return False
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            await writer.wait_closed()
+            return True
+        except OSError:
+            await asyncio.sleep(0.2)
+    return False
+
+class ManagedProcess:
+    """A child process that is started, logged and restarted by the supervisor"""
+
+    def __init__(self, name, cmd, port):
+        self.name = name
+        self.cmd = cmd
+        self.port = port
+        self.process = None
+        self.restarts = 0
+        self.ready = asyncio.Event()
+        self.stopping = False
+
+    async def start(self):
+        """Spawn the child with stdout and stderr merged into one pipe"""
+        self.process = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env={**os.environ, 'PYTHONUNBUFFERED': '1'}
+        )
+        return self.process
+
+    async def supervise(self):
+        """
+        Run the child until shutdown, restarting it with exponential backoff
+        if it crashes
+
+        Returns:
+            The last exit code if the child could not be kept running
+        """
+        backoff = RESTART_BACKOFF_INITIAL
+        while not self.stopping:
+            await self.start()
+            started_at = time.monotonic()
+            pump = asyncio.create_task(pump_output(self.name, self.process.stdout))
+
+            ready = await wait_for_port(self.port, process=self.process)
+            if not ready and self.process.returncode is None:
+                # Keep probing a slow child so a late start is still noticed
+                log_line(self.name, f"port {self.port} not reachable after {READY_TIMEOUT}s, still waiting")
+                ready = await wait_for_port(self.port, timeout=None, process=self.process)
+            if ready:
+                log_line(self.name, f"ready on port {self.port}")
+                self.ready.set()
+
+            return_code = await self.process.wait()
+            await pump
+            if self.stopping:
+                return return_code
+
+            if time.monotonic() - started_at >= STABLE_RUNTIME:
+                self.restarts = 0
+                backoff = RESTART_BACKOFF_INITIAL
+
+            self.restarts += 1
+            if self.restarts > MAX_RESTARTS:
+                log_line(self.name, f"exited with code {return_code}, giving up after {MAX_RESTARTS} restarts")
+                return return_code
+
+            log_line(self.name, f"exited with code {return_code}, restarting in {backoff}s "
+                                f"({self.restarts}/{MAX_RESTARTS})")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+        return None
+
+    async def stop(self):
+        """Terminate the child and wait for it to exit"""
+        self.stopping = True
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+async def run_supervisor():
+    """Start the API server and the frontend and keep them running"""
     # Determine the correct command based on the OS
     is_windows = platform.system() == "Windows"
     npm_cmd = "npm.cmd" if is_windows else "npm"
-    
+
+    api = ManagedProcess("API", [sys.executable, "run_api_server.py"], API_PORT)
+    frontend = ManagedProcess("Frontend", [npm_cmd, "run", "dev"], FRONTEND_PORT)
+    children = [api, frontend]
+    tasks = []
+
     try:
         # Start the API server
         print("\n[1/2] Starting API server...")
-        api_process = subprocess.Popen(
-            [sys.executable, "run_api_server.py"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
-        
-        # Wait for the API server to start
-        time.sleep(2)
-        
-        # Check if the API server is running
-        if api_process.poll() is not None:
+        api_task = asyncio.create_task(api.supervise())
+        tasks.append(api_task)
+        if not await _wait_ready(api, api_task):
             print("Error: Failed to start API server")
             return
-        
-        print("API server started successfully on port 8000")
-        
+        print(f"API server started successfully on port {API_PORT}")
+
         # Start the frontend
         print("\n[2/2] Starting frontend...")
-        frontend_process = subprocess.Popen(
-            [npm_cmd, "run", "dev"],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1
-        )
-        
-        # Wait for the frontend to start
-        time.sleep(5)
-        
-        # Check if the frontend is running
-        if frontend_process.poll() is not None:
+        frontend_task = asyncio.create_task(frontend.supervise())
+        tasks.append(frontend_task)
+        if not await _wait_ready(frontend, frontend_task):
             print("Error: Failed to start frontend")
-            api_process.terminate()
             return
-        
+
         print("Frontend started successfully")
         print("\nFakeDetector is now running!")
-        print("Open your browser and navigate to http://localhost:3000")
-        
+        print(f"Open your browser and navigate to http://localhost:{FRONTEND_PORT}")
+
         # Print instructions
         print("\nPress Ctrl+C to stop the application")
-        
-        # Monitor the processes
-        while True:
-            # Check if either process has terminated
-            if api_process.poll() is not None:
-                print("API server has stopped. Shutting down...")
-                frontend_process.terminate()
-                break
-            
-            if frontend_process.poll() is not None:
-                print("Frontend has stopped. Shutting down...")
-                api_process.terminate()
-                break
-            
-            # Read and print output from the API server
-            api_output = api_process.stdout.readline()
-            if api_output:
-                print(f"[API] {api_output.strip()}")
-            
-            # Read and print output from the frontend
-            frontend_output = frontend_process.stdout.readline()
-            if frontend_output:
-                print(f"[Frontend] {frontend_output.strip()}")
-            
-            time.sleep(0.1)
-    
+
+        # A supervisor task only finishes once its child has exhausted its restarts
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        stopped = api if api_task in done else frontend
+        print(f"{stopped.name} has stopped. Shutting down...")
+    finally:
+        await _shutdown(children, tasks)
+
+async def _wait_ready(child, task):
+    """Wait until a child is ready, or its supervisor gives up, or READY_TIMEOUT passes"""
+    ready = asyncio.create_task(child.ready.wait())
+    done, _ = await asyncio.wait([ready, task], timeout=READY_TIMEOUT,
+                                 return_when=asyncio.FIRST_COMPLETED)
+    if ready not in done:
+        ready.cancel()
+        return False
+    return True
+
+async def _shutdown(children, tasks):
+    """Stop all children and wait for their supervisors to finish"""
+    for child in children:
+        await child.stop()
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+def start_processes():
+    """Start both the API server and the frontend"""
+    print("Starting FakeDetector application...")
+
+    # Check if the API key is set
+    if not check_api_key():
+        return
+
+    try:
+        asyncio.run(run_supervisor())
     except KeyboardInterrupt:
         print("\nShutting down FakeDetector...")
-        
-        # Terminate the processes
-        if 'api_process' in locals():
-            api_process.terminate()
-        
-        if 'frontend_process' in locals():
-            frontend_process.terminate()
-        
         print("Application stopped")
 
 if __name__ == "__main__":
@@ -0,0 +1,232 @@
+import time
+import asyncio
+import threading
+import unittest
+from unittest import mock
+import analysis_scheduler
+from analysis_scheduler import AnalysisScheduler, QuotaExceededError, tenant_id, client_address, INTERACTIVE, BULK
+
+BULK_COST = analysis_scheduler.INTERACTIVE_MAX_TOKENS + 1000
+INTERACTIVE_COST = 100
+
+def finished():
+    """A job that succeeds without reporting usage, so it keeps its estimated charge"""
+    return 'done'
+
+def wait_until(predicate, timeout=5):
+    """Poll until predicate() is true, failing after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the scheduler")
+        time.sleep(0.01)
+
+class SchedulerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.gate = threading.Event()
+        self.order = []
+        self.threads = []
+
+    def tearDown(self):
+        self.gate.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def blocked_job(self):
+        self.gate.wait()
+
+    def record(self, name):
+        self.order.append(name)
+
+    def submit(self, scheduler, tenant, cost, func, *args):
+        """Submit a job from another thread and wait until it is queued or running"""
+        before = self.pending(scheduler)
+        thread = threading.Thread(target=scheduler.submit, args=(tenant, cost, func) + args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        wait_until(lambda: self.pending(scheduler) > before)
+        return thread
+
+    def pending(self, scheduler):
+        stats = scheduler.stats()
+        return sum(stats['queued'].values()) + sum(stats['running'].values()) + sum(
+            tenant['completed'] for tenant in stats['tenants'])
+
+class OrderingTest(SchedulerTestCase):
+
+    def test_tenants_are_interleaved_by_fair_queuing(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+        self.submit(scheduler, 'gate', BULK_COST, self.blocked_job)
+        for name in ('a1', 'a2', 'a3'):
+            self.submit(scheduler, 'a', BULK_COST, self.record, name)
+        for name in ('b1', 'b2', 'b3'):
+            self.submit(scheduler, 'b', BULK_COST, self.record, name)
+
+        self.gate.set()
+        wait_until(lambda: len(self.order) == 6)
+        self.assertEqual(self.order, ['a1', 'b1', 'a2', 'b2', 'a3', 'b3'])
+
+    def test_heavier_tenant_gets_more_turns(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={'a': 2.0})
+        self.submit(scheduler, 'gate', BULK_COST, self.blocked_job)
+        for name in ('a1', 'a2', 'a3', 'a4'):
+            self.submit(scheduler, 'a', BULK_COST, self.record, name)
+        for name in ('b1', 'b2'):
+            self.submit(scheduler, 'b', BULK_COST, self.record, name)
+
+        self.gate.set()
+        wait_until(lambda: len(self.order) == 6)
+        self.assertEqual(self.order, ['a1', 'a2', 'b1', 'a3', 'a4', 'b2'])
+
+    def test_interactive_lane_runs_before_bulk(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+        self.submit(scheduler, 'gate', BULK_COST, self.blocked_job)
+        self.submit(scheduler, 'a', BULK_COST, self.record, 'bulk')
+        self.submit(scheduler, 'b', INTERACTIVE_COST, self.record, 'interactive')
+
+        self.gate.set()
+        wait_until(lambda: len(self.order) == 2)
+        self.assertEqual(self.order, ['interactive', 'bulk'])
+
+    def test_worker_is_reserved_for_interactive_jobs(self):
+        scheduler = AnalysisScheduler(max_workers=2, weights={})
+        self.submit(scheduler, 'gate', BULK_COST, self.blocked_job)
+        self.submit(scheduler, 'a', BULK_COST, self.record, 'bulk')
+        # The second worker stays free for interactive uploads while bulk work waits
+        self.submit(scheduler, 'b', INTERACTIVE_COST, self.record, 'interactive')
+        wait_until(lambda: self.order == ['interactive'])
+
+        stats = scheduler.stats()
+        self.assertEqual(stats['queued'][BULK], 1)
+        self.assertEqual(stats['running'][INTERACTIVE], 0)
+
+        self.gate.set()
+        wait_until(lambda: len(self.order) == 2)
+
+    def test_coroutine_jobs_share_one_event_loop(self):
+        scheduler = AnalysisScheduler(max_workers=3, weights={})
+
+        async def current_loop():
+            await asyncio.sleep(0.01)
+            return asyncio.get_running_loop()
+
+        loops = {scheduler.submit(f'tenant-{i}', INTERACTIVE_COST, current_loop) for i in range(3)}
+        self.assertEqual(loops, {scheduler.loop})
+
+    def test_job_errors_are_raised_to_the_caller(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+
+        def fail():
+            raise ValueError("analysis failed")
+
+        with self.assertRaises(ValueError):
+            scheduler.submit('a', INTERACTIVE_COST, fail)
+
+@mock.patch.object(analysis_scheduler, 'TENANT_BUDGET_WINDOW', 100)
+@mock.patch.object(analysis_scheduler, 'TENANT_TOKEN_BUDGET', 1000)
+class BudgetTest(unittest.TestCase):
+
+    def test_over_budget_job_is_rejected_with_retry_after(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+        scheduler.submit('a', 800, finished)
+
+        with self.assertRaises(QuotaExceededError) as raised:
+            scheduler.submit('a', 800, finished)
+        # 200 tokens left, refilling at 10 tokens per second
+        self.assertAlmostEqual(raised.exception.retry_after, 60, delta=1)
+        self.assertEqual(scheduler.tenants['a'].rejected, 1)
+
+        # Other tenants have budgets of their own
+        scheduler.submit('b', 800, finished)
+
+    def test_budget_refills_over_time(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+        scheduler.submit('a', 800, finished)
+        scheduler.tenants['a'].refilled_at -= 60
+
+        self.assertEqual(scheduler.submit('a', 800, finished), 'done')
+
+    def test_failed_jobs_are_refunded(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+
+        def fail():
+            raise ValueError("model error")
+
+        with self.assertRaises(ValueError):
+            scheduler.submit('a', 800, fail)
+        scheduler.submit('a', 800, lambda: None)
+        # Neither job produced a result, so the whole budget is still there
+        self.assertAlmostEqual(scheduler.tenants['a'].tokens, 1000, delta=1)
+
+    def test_jobs_pay_for_the_tokens_they_used(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+        usage = {'usage': {'prompt_tokens': 150, 'completion_tokens': 50}}
+        scheduler.submit('a', 800, lambda: usage)
+        self.assertAlmostEqual(scheduler.tenants['a'].tokens, 800, delta=1)
+        self.assertEqual(scheduler.stats()['tenants'][0]['tokensServed'], 200)
+
+        # Results without usage keep the estimated charge
+        scheduler.submit('b', 500, lambda: {'reviews': []})
+        self.assertAlmostEqual(scheduler.tenants['b'].tokens, 500, delta=1)
+
+    def test_idle_tenants_are_evicted(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+        scheduler.submit('a', 800, finished)
+        scheduler.submit('b', 800, finished)
+        self.assertEqual(set(scheduler.tenants), {'a', 'b'})
+
+        # Once 'a' has its whole budget back it is forgotten when someone new arrives
+        scheduler.tenants['a'].refilled_at -= 100
+        scheduler.submit('c', 800, finished)
+        self.assertEqual(set(scheduler.tenants), {'b', 'c'})
+
+        # Its history moves to the 'evicted' entry, so shares still add up
+        stats = scheduler.stats()
+        self.assertEqual((stats['evicted']['tenants'], stats['evicted']['completed']), (1, 1))
+        self.assertEqual(stats['evicted']['tokensServed'], 800)
+        shares = [tenant['shareOfCapacity'] for tenant in stats['tenants']] + [stats['evicted']['shareOfCapacity']]
+        self.assertAlmostEqual(sum(shares), 1.0, places=2)
+
+    def test_clients_behind_one_proxy_get_separate_budgets(self):
+        scheduler = AnalysisScheduler(max_workers=1, weights={})
+        first = tenant_id(None, client_address('10.0.0.2', '203.0.113.7', '10.0.0.0/8'), set())
+        second = tenant_id(None, client_address('10.0.0.2', '198.51.100.9', '10.0.0.0/8'), set())
+        self.assertNotEqual(first, second)
+
+        scheduler.submit(first, 800, finished)
+        with self.assertRaises(QuotaExceededError):
+            scheduler.submit(first, 800, finished)
+        self.assertEqual(scheduler.submit(second, 800, finished), 'done')
+
+class ClientAddressTest(unittest.TestCase):
+
+    def test_forwarded_header_is_ignored_without_trusted_proxies(self):
+        self.assertEqual(client_address('198.51.100.9', '203.0.113.7', ''), '198.51.100.9')
+
+    def test_forwarded_header_from_untrusted_peer_is_ignored(self):
+        self.assertEqual(client_address('198.51.100.9', '203.0.113.7', '10.0.0.0/8'), '198.51.100.9')
+
+    def test_trusted_proxies_are_skipped_from_the_right(self):
+        # The client made up the first entry; only hops added by trusted proxies count
+        forwarded = '1.2.3.4, 203.0.113.7, 10.0.0.3'
+        self.assertEqual(client_address('10.0.0.2', forwarded, '10.0.0.0/8'), '203.0.113.7')
+        self.assertEqual(client_address('10.0.0.2', forwarded, '10.0.0.2, 10.0.0.3'), '203.0.113.7')
+
+    def test_wildcard_trusts_only_the_direct_proxy(self):
+        self.assertEqual(client_address('10.0.0.2', '1.2.3.4, 203.0.113.7', '*'), '203.0.113.7')
+        self.assertEqual(client_address('10.0.0.2', None, '*'), '10.0.0.2')
+
+class TenantIdTest(unittest.TestCase):
+
+    def test_only_allowlisted_keys_get_their_own_tenant(self):
+        self.assertTrue(tenant_id('good-key', '10.0.0.1', {'good-key'}).startswith('key:'))
+        self.assertEqual(tenant_id('made-up-key', '10.0.0.1', {'good-key'}), tenant_id(None, '10.0.0.1', {'good-key'}))
+
+    def test_ids_do_not_reveal_keys_or_addresses(self):
+        for value in (tenant_id('good-key', '10.0.0.1', {'good-key'}), tenant_id(None, '10.0.0.1', set())):
+            self.assertNotIn('good-key', value)
+            self.assertNotIn('10.0.0.1', value)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import sys
+import gzip
+import json
+import threading
+import http.client
+import unittest
+from unittest import mock
+from http.server import ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api'))
+import analyze_reviews
+from analyze_reviews import choose_encoding, etag_matches, paginate_result, store_result, ReviewAnalyzerHandler
+
+class ChooseEncodingTest(unittest.TestCase):
+
+    def test_prefers_brotli_when_available(self):
+        with mock.patch.object(analyze_reviews, 'brotli', object()):
+            self.assertEqual(choose_encoding('gzip, deflate, br'), 'br')
+
+    def test_falls_back_to_gzip_without_brotli(self):
+        with mock.patch.object(analyze_reviews, 'brotli', None):
+            self.assertEqual(choose_encoding('gzip, deflate, br'), 'gzip')
+
+    def test_q_zero_refuses_an_encoding(self):
+        with mock.patch.object(analyze_reviews, 'brotli', object()):
+            self.assertEqual(choose_encoding('br;q=0, gzip;q=0.5'), 'gzip')
+            self.assertIsNone(choose_encoding('gzip;q=0'))
+
+    def test_wildcard(self):
+        with mock.patch.object(analyze_reviews, 'brotli', None):
+            self.assertEqual(choose_encoding('*'), 'gzip')
+            self.assertIsNone(choose_encoding('*;q=0'))
+            # An explicit entry overrides the wildcard
+            self.assertIsNone(choose_encoding('gzip;q=0, *'))
+
+    def test_missing_or_invalid_header(self):
+        self.assertIsNone(choose_encoding(''))
+        self.assertIsNone(choose_encoding('identity'))
+        self.assertIsNone(choose_encoding('gzip;q=abc'))
+
+class EtagMatchesTest(unittest.TestCase):
+    HASH = '0123456789abcdef'
+
+    def test_plain_and_weak_tags(self):
+        self.assertTrue(etag_matches(f'"{self.HASH}"', self.HASH))
+        self.assertTrue(etag_matches(f'W/"{self.HASH}"', self.HASH))
+
+    def test_encoding_suffix_is_ignored(self):
+        self.assertTrue(etag_matches(f'"{self.HASH}-gzip"', self.HASH))
+        self.assertTrue(etag_matches(f'W/"{self.HASH}-br"', self.HASH))
+
+    def test_list_and_wildcard(self):
+        self.assertTrue(etag_matches(f'"other", "{self.HASH}-gzip"', self.HASH))
+        self.assertTrue(etag_matches('*', self.HASH))
+
+    def test_mismatch(self):
+        self.assertFalse(etag_matches('', self.HASH))
+        self.assertFalse(etag_matches('"other"', self.HASH))
+        self.assertFalse(etag_matches(f'"{self.HASH}-deflate"', self.HASH))
+
+class PaginateResultTest(unittest.TestCase):
+    DATA = {'stats': {'real': 5, 'fake': 25}, 'fakeReviews': [f'review {i}' for i in range(25)]}
+
+    def test_whole_result_without_paging_parameters(self):
+        response = paginate_result(self.DATA, 'abc', {})
+        self.assertEqual(response['fakeReviews'], self.DATA['fakeReviews'])
+        self.assertNotIn('page', response)
+
+    def test_pages(self):
+        response = paginate_result(self.DATA, 'abc', {'page': ['3'], 'pageSize': ['10']})
+        self.assertEqual(response['fakeReviews'], self.DATA['fakeReviews'][20:])
+        self.assertEqual((response['page'], response['totalPages'], response['totalFakeReviews']), (3, 3, 25))
+
+    def test_out_of_range_values_are_clamped(self):
+        response = paginate_result(self.DATA, 'abc', {'page': ['-1'], 'pageSize': ['100000']})
+        self.assertEqual((response['page'], response['pageSize']), (1, analyze_reviews.MAX_PAGE_SIZE))
+        response = paginate_result(self.DATA, 'abc', {'page': ['x']})
+        self.assertEqual((response['page'], response['pageSize']), (1, analyze_reviews.DEFAULT_PAGE_SIZE))
+
+    def test_incomplete_flags_are_passed_on(self):
+        data = dict(self.DATA, incomplete=True, failedBatches=1, totalBatches=3)
+        response = paginate_result(data, 'abc', {})
+        self.assertEqual((response['incomplete'], response['failedBatches'], response['totalBatches']), (True, 1, 3))
+
+class ConditionalGetTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), ReviewAnalyzerHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        data = {'stats': {'real': 0, 'fake': 200}, 'fakeReviews': [f'fake review number {i}' for i in range(200)]}
+        cls.path = '/api/results/' + store_result(data)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def get(self, headers):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1])
+        connection.request('GET', self.path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+        connection.close()
+        return response, body
+
+    def test_gzip_response_has_its_own_etag(self):
+        plain, plain_body = self.get({})
+        compressed, compressed_body = self.get({'Accept-Encoding': 'gzip'})
+        self.assertEqual(compressed.getheader('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.decompress(compressed_body), plain_body)
+        self.assertEqual(compressed.getheader('ETag'), plain.getheader('ETag')[:-1] + '-gzip"')
+        self.assertEqual(json.loads(plain_body)['stats']['fake'], 200)
+
+    def test_matching_etag_returns_304(self):
+        first, _ = self.get({'Accept-Encoding': 'gzip'})
+        # A tag from another encoding, or weakened by a proxy, still matches
+        for tag in (first.getheader('ETag'), 'W/' + first.getheader('ETag')):
+            response, body = self.get({'If-None-Match': tag})
+            self.assertEqual(response.status, 304)
+            self.assertEqual(body, b'')
+
+    def test_stale_etag_returns_body(self):
+        response, body = self.get({'If-None-Match': '"stale"'})
+        self.assertEqual(response.status, 200)
+        self.assertTrue(body)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import gzip
+import shutil
+import asyncio
+import tempfile
+import threading
+import unittest
+import model_replay
+import openrouter_client
+from model_replay import ReplayArchive, ReplayMissError, payload_key
+
+PAYLOAD = {'model': 'thudm/glm-4-9b:free', 'messages': [{'role': 'user', 'content': 'Is this review fake?'}]}
+
+class FakeResponse:
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+class FakeClient:
+    """Stands in for httpx.AsyncClient and counts the requests it gets"""
+
+    def __init__(self, status_code=200, text='{"choices": []}'):
+        self.status_code = status_code
+        self.text = text
+        self.requests = 0
+
+    async def post(self, url, headers=None, json=None):
+        self.requests += 1
+        return FakeResponse(self.status_code, self.text)
+
+class ReplayTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.archive_dir, ignore_errors=True)
+        self.archive_path = os.path.join(self.archive_dir, 'responses.jsonl.gz')
+        self.addCleanup(model_replay.configure, model_replay.get_mode())
+        self.addCleanup(setattr, model_replay, '_archive', model_replay.get_archive())
+
+    def call(self, client=None):
+        return asyncio.run(openrouter_client.post_chat_completion('key', PAYLOAD, client))
+
+class ReplayArchiveTest(ReplayTestCase):
+
+    def test_payload_key_ignores_key_order(self):
+        reordered = {'messages': PAYLOAD['messages'], 'model': PAYLOAD['model']}
+        self.assertEqual(payload_key(PAYLOAD), payload_key(reordered))
+        self.assertNotEqual(payload_key(PAYLOAD), payload_key(dict(PAYLOAD, model='other')))
+
+    def test_appends_one_gzip_member_per_recording(self):
+        first = ReplayArchive(self.archive_path)
+        first.record('a', 200, 'first', 1.0)
+        first.record('a', 200, 'duplicate', 1.0)
+        # A second process appending to the same file
+        ReplayArchive(self.archive_path).record('b', 200, 'second', 2.0)
+
+        with open(self.archive_path, 'rb') as f:
+            self.assertEqual(f.read().count(b'\x1f\x8b\x08'), 2)
+        with gzip.open(self.archive_path, 'rt', encoding='utf-8') as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+        reloaded = ReplayArchive(self.archive_path)
+        self.assertEqual(reloaded.get('a')['response_text'], 'first')
+        self.assertEqual(reloaded.get('b')['elapsed_time'], 2.0)
+        self.assertIsNone(reloaded.get('c'))
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            model_replay.configure('rewind')
+
+class RecordReplayTest(ReplayTestCase):
+
+    def test_record_then_replay_without_network(self):
+        model_replay.configure('record', self.archive_path)
+        client = FakeClient(text='{"answer": 42}')
+        self.assertEqual(self.call(client)[:2], (200, '{"answer": 42}'))
+        self.assertEqual(client.requests, 1)
+
+        model_replay.configure('replay', self.archive_path)
+        offline = FakeClient(text='not used')
+        status_code, response_text, _ = self.call(offline)
+        self.assertEqual((status_code, response_text), (200, '{"answer": 42}'))
+        self.assertEqual(offline.requests, 0)
+
+    def test_failed_responses_are_not_recorded(self):
+        model_replay.configure('record', self.archive_path)
+        self.call(FakeClient(status_code=429, text='rate limited'))
+        self.assertFalse(os.path.exists(self.archive_path))
+
+    def test_missing_recording_raises(self):
+        model_replay.configure('replay', self.archive_path)
+        with self.assertRaises(ReplayMissError):
+            self.call(FakeClient())
+
+    def test_archive_io_runs_off_the_event_loop(self):
+        threads = []
+        archive = ReplayArchive(self.archive_path)
+        original_record = archive.record
+
+        def record(*args):
+            threads.append(threading.get_ident())
+            original_record(*args)
+
+        archive.record = record
+        model_replay.configure('record')
+        model_replay._archive = archive
+
+        async def call_and_get_loop_thread():
+            await openrouter_client.post_chat_completion('key', PAYLOAD, FakeClient())
+            return threading.get_ident()
+
+        loop_thread = asyncio.run(call_and_get_loop_thread())
+        self.assertEqual(len(threads), 1)
+        self.assertNotEqual(threads[0], loop_thread)
+
+if __name__ == "__main__":
+    unittest.main()
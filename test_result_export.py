@@ -0,0 +1,122 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from result_export import pa
+from result_export import ResultExporter, EXPORT_COLUMNS, _to_confidence
+
+MODEL_ID = 'thudm/glm-4-9b:free'
+
+REVIEWS = [
+    {'reviewer_name': 'Ann', 'star_rating': 5, 'review_text': 'Great phone, the battery lasts all day'},
+    {'reviewer_name': 'Bob', 'star_rating': 1, 'review_text': 'Broke after a week'},
+    {'reviewer_name': 'Cy', 'star_rating': 5, 'review_text': 'BEST PRODUCT EVER buy now ' * 20},
+]
+
+def batch_of(*indexes):
+    """Build a batch the way pack_reviews does, with the text of review 2 truncated"""
+    batch = []
+    for index in indexes:
+        sent = REVIEWS[index]
+        if index == 2:
+            sent = dict(sent, review_text='BEST PRODUCT EVER [...truncated]')
+        batch.append((index, sent, REVIEWS[index]))
+    return batch
+
+def result_for(verdicts):
+    return {
+        'model': MODEL_ID,
+        'usage': {'elapsed_time': 1.5},
+        'reviews': [{'index': index, 'classification': label, 'confidence': confidence, 'explanation': 'x'}
+                    for index, label, confidence in verdicts]
+    }
+
+@unittest.skipIf(pa is None, "exporting needs the optional pyarrow package")
+class ResultExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.source_path = self.path('reviews.xlsx')
+        pd.DataFrame({
+            'Reviewer Name': [r['reviewer_name'] for r in REVIEWS],
+            'Star Rating': [r['star_rating'] for r in REVIEWS],
+            'Review Text': [r['review_text'] for r in REVIEWS],
+        }).to_excel(self.source_path, index=False)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def export(self, *paths):
+        exporter = ResultExporter([self.path(p) for p in paths], self.source_path, MODEL_ID)
+        exporter.write_batch(batch_of(0, 2), result_for([(0, 'real', 0.9), (2, 'FAKE', 95)]))
+        exporter.write_batch(batch_of(1), None)
+        exporter.close()
+        return exporter
+
+    def test_parquet_has_one_row_group_per_batch(self):
+        exporter = self.export('out.parquet')
+        parquet_file = pa.parquet.ParquetFile(self.path('out.parquet'))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 2)
+        self.assertEqual((exporter.batches_written, exporter.rows_written), (2, 3))
+
+        table = parquet_file.read().to_pandas()
+        self.assertEqual(list(table.columns), EXPORT_COLUMNS)
+        self.assertEqual(table['row'].tolist(), [0, 2, 1])
+        self.assertEqual(table['label'].tolist()[:2], ['REAL', 'FAKE'])
+        self.assertEqual(table['confidence'].tolist()[:2], [0.9, 0.95])
+        self.assertEqual(table['batch'].tolist(), [1, 1, 2])
+
+    def test_arrow_file_has_one_record_batch_per_batch(self):
+        self.export('out.arrow')
+        with pa.memory_map(self.path('out.arrow')) as source:
+            reader = pa.ipc.open_file(source)
+            self.assertEqual(reader.num_record_batches, 2)
+            self.assertEqual(reader.read_all().num_rows, 3)
+
+    def test_failed_batch_rows_have_no_verdict(self):
+        self.export('out.parquet')
+        rows = pa.parquet.read_table(self.path('out.parquet')).to_pylist()
+        failed = next(row for row in rows if row['row'] == 1)
+        self.assertIsNone(failed['label'])
+        self.assertIsNone(failed['confidence'])
+        self.assertIsNone(failed['latency_seconds'])
+        self.assertEqual(failed['model'], MODEL_ID)
+        self.assertEqual(failed['review_text'], REVIEWS[1]['review_text'])
+
+    def test_full_review_text_is_exported(self):
+        self.export('out.parquet')
+        table = pa.parquet.read_table(self.path('out.parquet')).to_pandas()
+        self.assertEqual(table[table['row'] == 2].iloc[0]['review_text'], REVIEWS[2]['review_text'])
+
+    def test_annotated_workbook(self):
+        self.export('annotated.xlsx')
+        df = pd.read_excel(self.path('annotated.xlsx'))
+        self.assertEqual(len(df), len(REVIEWS))
+        self.assertEqual(df['Review Text'].tolist(), [r['review_text'] for r in REVIEWS])
+        self.assertEqual(df.loc[0, 'AI Label'], 'REAL')
+        self.assertEqual(df.loc[2, 'AI Confidence'], 0.95)
+        self.assertTrue(pd.isna(df.loc[1, 'AI Label']))
+
+    def test_unsupported_path_closes_writers_already_opened(self):
+        with self.assertRaises(ValueError):
+            ResultExporter([self.path('out.parquet'), self.path('out.csv')], self.source_path, MODEL_ID)
+        # The Parquet file was finished with a footer, so it can be read
+        self.assertEqual(pa.parquet.read_table(self.path('out.parquet')).num_rows, 0)
+
+class ToConfidenceTest(unittest.TestCase):
+
+    def test_values_are_normalised(self):
+        self.assertEqual(_to_confidence(0.8), 0.8)
+        self.assertEqual(_to_confidence('0.25'), 0.25)
+        self.assertEqual(_to_confidence(85), 0.85)
+        self.assertEqual(_to_confidence(150), 1.0)
+        self.assertEqual(_to_confidence(-0.5), 0.0)
+
+    def test_unusable_values_become_none(self):
+        self.assertIsNone(_to_confidence(None))
+        self.assertIsNone(_to_confidence('high'))
+
+if __name__ == "__main__":
+    unittest.main()
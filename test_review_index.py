@@ -0,0 +1,141 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from numpy.lib.format import open_memmap
+import review_index
+from review_index import ReviewIndex, review_id
+
+TEXTS = [
+    "The battery lasts two full days and the screen is bright and sharp",
+    "Terrible blender, the motor burned out after one week of smoothies",
+    "Best coffee maker ever!!! Amazing amazing amazing, buy it now",
+    "The cookbook has clear recipes and lovely photos of every dish",
+    "Earbuds fit well but the left one stopped charging after a month",
+    "Hair dryer is loud and gets too hot, returned it the next day",
+]
+
+def make_review(text, name='Reviewer'):
+    return {'reviewer_name': name, 'star_rating': 4, 'review_text': text}
+
+class ReviewIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        self.reviews = [make_review(text) for text in TEXTS]
+
+    def build(self):
+        index = ReviewIndex(self.index_dir)
+        index.add_reviews(self.reviews, source='test.xlsx', classifications={TEXTS[2]: 'FAKE'})
+        return index
+
+    def test_add_skips_duplicates(self):
+        index = ReviewIndex(self.index_dir)
+        self.assertEqual(index.add_reviews(self.reviews + self.reviews[:2]), len(TEXTS))
+        self.assertEqual(index.add_reviews(self.reviews), 0)
+        # Same text from another reviewer is a different review
+        self.assertEqual(index.add_reviews([make_review(TEXTS[0], 'Someone else')]), 1)
+        self.assertEqual(index.count, len(TEXTS) + 1)
+
+    def test_search_by_text(self):
+        index = self.build()
+        results = index.search(text=TEXTS[1], k=3)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['review_text'], TEXTS[1])
+        self.assertAlmostEqual(results[0]['score'], 1.0, places=3)
+        self.assertEqual([r['score'] for r in results], sorted((r['score'] for r in results), reverse=True))
+
+    def test_search_keeps_metadata(self):
+        index = self.build()
+        result = index.search(text=TEXTS[2], k=1)[0]
+        self.assertEqual((result['source'], result['classification']), ('test.xlsx', 'FAKE'))
+
+    def test_search_by_id_excludes_the_review_itself(self):
+        index = self.build()
+        rid = review_id(self.reviews[0])
+        results = index.search(rid=rid, k=10)
+        self.assertEqual(len(results), len(TEXTS) - 1)
+        self.assertNotIn(rid, [r['id'] for r in results])
+        self.assertIsNone(index.search(rid='unknown'))
+
+    def test_empty_queries(self):
+        index = ReviewIndex(self.index_dir)
+        self.assertEqual(index.search(text=TEXTS[0]), [])
+        index.add_reviews(self.reviews[:1])
+        self.assertEqual(index.search(text=''), [])
+        self.assertEqual(index.search(rid=review_id(self.reviews[0])), [])
+
+    def test_approximate_search_finds_exact_text(self):
+        index = self.build()
+        with mock.patch.object(review_index, 'EXACT_SCAN_ROWS', 0):
+            for text in TEXTS:
+                self.assertEqual(index.search(text=text, k=1)[0]['review_text'], text)
+
+    def test_reload_from_disk(self):
+        index = self.build()
+        expected = index.search(text=TEXTS[3], k=4)
+        del index
+
+        reloaded = ReviewIndex(self.index_dir)
+        self.assertEqual(reloaded.count, len(TEXTS))
+        self.assertEqual(reloaded.search(text=TEXTS[3], k=4), expected)
+        self.assertEqual(reloaded.add_reviews(self.reviews), 0)
+
+    def test_rows_past_the_saved_state_are_dropped(self):
+        self.build()
+        with open(os.path.join(self.index_dir, 'metadata.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'id': 'partial', 'review_text': 'half written'}) + '\n')
+
+        reloaded = ReviewIndex(self.index_dir)
+        self.assertEqual(len(reloaded.metadata), len(TEXTS))
+        self.assertNotIn('partial', reloaded.rows_by_id)
+
+    def test_older_index_is_rebuilt(self):
+        index = self.build()
+        capacity = index.vectors.shape[0]
+        # Fake a version 2 index: IDF-weighted vectors and a single hash table
+        index.vectors[:index.count] *= np.linspace(0.1, 5.0, review_index.DIMENSIONS, dtype=np.float32)
+        index.vectors.flush()
+        del index
+        signatures_path = os.path.join(self.index_dir, 'signatures.npy')
+        old_signatures = open_memmap(signatures_path, mode='w+', dtype=np.uint32, shape=(capacity,))
+        del old_signatures
+        state_path = os.path.join(self.index_dir, 'state.json')
+        with open(state_path) as f:
+            state = json.load(f)
+        state['version'] = 2
+        with open(state_path, 'w') as f:
+            json.dump(state, f)
+
+        rebuilt = ReviewIndex(self.index_dir)
+        self.assertEqual(rebuilt.signatures.shape, (capacity, review_index.NUM_TABLES))
+        for row, text in enumerate(TEXTS):
+            np.testing.assert_allclose(rebuilt.vectors[row], rebuilt.vectorize(text), rtol=1e-6)
+            np.testing.assert_array_equal(rebuilt.signatures[row], rebuilt.signature(rebuilt.vectorize(text)))
+        with open(state_path) as f:
+            self.assertEqual(json.load(f)['version'], review_index.INDEX_VERSION)
+        with mock.patch.object(review_index, 'EXACT_SCAN_ROWS', 0):
+            result = rebuilt.search(text=TEXTS[4], k=1)[0]
+        self.assertEqual(result['review_text'], TEXTS[4])
+        self.assertAlmostEqual(result['score'], 1.0, places=3)
+
+    def test_matrices_grow_when_full(self):
+        with mock.patch.object(review_index, 'INITIAL_CAPACITY', 2):
+            index = ReviewIndex(self.index_dir)
+            index.add_reviews(self.reviews[:1])
+            index.add_reviews(self.reviews[1:])
+        self.assertEqual(index.vectors.shape[0], 8)
+        self.assertEqual(index.signatures.shape[0], 8)
+        for text in TEXTS:
+            self.assertEqual(index.search(text=text, k=1)[0]['review_text'], text)
+
+        reloaded = ReviewIndex(self.index_dir)
+        self.assertEqual(reloaded.vectors.shape[0], 8)
+        self.assertEqual(reloaded.search(text=TEXTS[5], k=1)[0]['review_text'], TEXTS[5])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from token_budget import (estimate_tokens, truncate_text, review_cost, request_budget, pack_reviews,
+                          TRUNCATION_MARKER)
+
+MODEL_ID = "thudm/glm-4-9b:free"
+PROMPT_TOKENS = 300
+
+def make_reviews(lengths):
+    """Build reviews whose text has the given number of words"""
+    return [{'reviewer_name': f'Reviewer {i}', 'star_rating': 4, 'review_text': ' '.join(['great'] * length)}
+            for i, length in enumerate(lengths)]
+
+class PackReviewsTest(unittest.TestCase):
+
+    def check_batches_fit(self, reviews, echo_text):
+        total_budget, output_budget = request_budget(MODEL_ID, PROMPT_TOKENS)
+        batches = pack_reviews(reviews, MODEL_ID, PROMPT_TOKENS, echo_text=echo_text)
+        for batch in batches:
+            costs = [review_cost(sent, echo_text) for _, sent, _ in batch]
+            self.assertLessEqual(sum(total for total, _ in costs) + sum(output for _, output in costs), total_budget)
+            self.assertLessEqual(sum(output for _, output in costs), output_budget)
+        return batches
+
+    def test_every_batch_fits_the_context(self):
+        reviews = make_reviews([5, 40, 300, 12, 800, 3] * 30)
+        for echo_text in (True, False):
+            self.check_batches_fit(reviews, echo_text)
+
+    def test_every_review_is_sent_once_in_order(self):
+        reviews = make_reviews([5, 40, 300, 12, 800, 3] * 30)
+        batches = pack_reviews(reviews, MODEL_ID, PROMPT_TOKENS)
+        indexes = [index for batch in batches for index, _, _ in batch]
+        self.assertEqual(sorted(indexes), list(range(len(reviews))))
+        for batch in batches:
+            self.assertEqual([index for index, _, _ in batch], sorted(index for index, _, _ in batch))
+
+    def test_long_review_is_truncated_but_original_kept(self):
+        reviews = make_reviews([5, 50000])
+        batches = self.check_batches_fit(reviews, echo_text=True)
+        _, sent, original = next(item for batch in batches for item in batch if item[0] == 1)
+        self.assertTrue(sent['review_text'].endswith(TRUNCATION_MARKER))
+        self.assertIs(original, reviews[1])
+        self.assertNotIn(TRUNCATION_MARKER, original['review_text'])
+
+    def test_short_reviews_are_sent_untouched(self):
+        reviews = make_reviews([5, 10])
+        for batch in pack_reviews(reviews, MODEL_ID, PROMPT_TOKENS):
+            for index, sent, original in batch:
+                self.assertIs(sent, original)
+
+    def test_max_reviews_caps_batch_size(self):
+        reviews = make_reviews([5] * 23)
+        batches = pack_reviews(reviews, MODEL_ID, PROMPT_TOKENS, max_reviews=5)
+        self.assertEqual(len(batches), 5)
+        self.assertTrue(all(len(batch) <= 5 for batch in batches))
+
+class TruncateTextTest(unittest.TestCase):
+
+    def test_short_text_is_unchanged(self):
+        self.assertEqual(truncate_text("short text", 100), "short text")
+
+    def test_long_text_fits_the_limit(self):
+        text = ' '.join(['word'] * 1000)
+        truncated = truncate_text(text, 50)
+        self.assertTrue(truncated.endswith(TRUNCATION_MARKER))
+        self.assertLessEqual(estimate_tokens(truncated[:-len(TRUNCATION_MARKER)]), 50)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+import re
+import math
+
+# Context window and maximum completion size of the models we use, in tokens.
+# Covers the models recommended in chat_with_ai.list_free_models.
+MODEL_LIMITS = {
+    "thudm/glm-4-9b:free": {"context": 32768, "max_output": 8192},
+    "microsoft/mai-ds-r1:free": {"context": 163840, "max_output": 32768},
+    "huggingfaceh4/zephyr-7b-beta:free": {"context": 4096, "max_output": 2048},
+    "thudm/glm-z1-32b:free": {"context": 32768, "max_output": 8192},
+    "moonshotai/kimi-vl-a3b-thinking:free": {"context": 131072, "max_output": 16384},
+}
+
+# Used for models that are not in the registry
+DEFAULT_LIMITS = {"context": 8192, "max_output": 4096}
+
+# Fraction of the context window kept free to absorb estimation error
+SAFETY_MARGIN = 0.1
+
+# Expected output per review on top of any echoed review text
+# (classification, explanation and JSON punctuation)
+OUTPUT_TOKENS_PER_REVIEW = 60
+
+# Expected output for the summary block and the JSON wrapper
+OUTPUT_TOKENS_FIXED = 60
+
+# Multiplier on the expected output to leave room for reasoning models
+OUTPUT_HEADROOM = 1.5
+
+# A single review may use at most this share of a request's budget
+MAX_REVIEW_SHARE = 0.25
+
+TRUNCATION_MARKER = " [...truncated]"
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text):
+    """
+    Estimate how many tokens a piece of text uses
+
+    This is a fast local approximation of BPE tokenizers: it counts words and
+    punctuation, and falls back to roughly four characters per token for
+    text made of long words.
+
+    Args:
+        text: Text to measure
+
+    Returns:
+        Estimated number of tokens
+    """
+    if not text:
+        return 0
+    text = str(text)
+    pieces = len(_TOKEN_PATTERN.findall(text))
+    return max(pieces, math.ceil(len(text) / 4))
+
+def get_model_limits(model_id):
+    """
+    Look up the context window and maximum output size of a model
+
+    Args:
+        model_id: ID of the model
+
+    Returns:
+        Dictionary with 'context' and 'max_output' token counts
+    """
+    return MODEL_LIMITS.get(model_id, DEFAULT_LIMITS)
+
+def get_context_window(model_id):
+    """Get the context window of a model in tokens"""
+    return get_model_limits(model_id)["context"]
+
+def truncate_text(text, max_tokens):
+    """
+    Cut text down to roughly max_tokens tokens, marking that it was cut
+
+    Args:
+        text: Text to truncate
+        max_tokens: Token budget for the text, including the marker
+
+    Returns:
+        The original text if it fits, otherwise a shortened copy ending in TRUNCATION_MARKER
+    """
+    text = str(text)
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    budget = max(max_tokens - estimate_tokens(TRUNCATION_MARKER), 1)
+    # Start from the character estimate and trim until the token estimate fits
+    cut = min(len(text), budget * 4)
+    while cut > 0 and estimate_tokens(text[:cut]) > budget:
+        cut = int(cut * 0.9)
+    return text[:cut].rstrip() + TRUNCATION_MARKER
+
+def review_line(index, review):
+    """Format one review the way it appears in the analysis prompt"""
+    reviewer = review.get('reviewer_name', 'Anonymous')
+    rating = review.get('star_rating', 'N/A')
+    text = review.get('review_text', '')
+    return f"\nReview #{index} - Reviewer: {reviewer}, Rating: {rating} stars\n{text}\n"
+
+def review_cost(review, echo_text=True):
+    """
+    Estimate the input and output tokens one review adds to a request
+
+    Args:
+        review: Review dictionary
+        echo_text: Whether the model is asked to repeat the review text back
+
+    Returns:
+        Tuple of (input_tokens, output_tokens)
+    """
+    input_tokens = estimate_tokens(review_line(0, review))
+    output_tokens = OUTPUT_TOKENS_PER_REVIEW
+    if echo_text:
+        output_tokens += estimate_tokens(review.get('review_text', ''))
+    return input_tokens, math.ceil(output_tokens * OUTPUT_HEADROOM)
+
+def request_budget(model_id, prompt_tokens):
+    """
+    Work out how many tokens of reviews fit in one request
+
+    Args:
+        model_id: ID of the model
+        prompt_tokens: Tokens used by the fixed part of the prompt
+
+    Returns:
+        Tuple of (total_budget, output_budget); reviews must keep input plus
+        output under the first and output under the second
+    """
+    limits = get_model_limits(model_id)
+    fixed_output = math.ceil(OUTPUT_TOKENS_FIXED * OUTPUT_HEADROOM)
+    total = int(limits["context"] * (1 - SAFETY_MARGIN)) - prompt_tokens - fixed_output
+    output = limits["max_output"] - fixed_output
+    return max(total, 0), max(output, 0)
+
+def pack_reviews(reviews, model_id, prompt_tokens, echo_text=True, max_reviews=None):
+    """
+    Split reviews into as few requests as possible without overflowing the model
+
+    Uses first-fit decreasing bin packing on the estimated cost of each
+    review. Reviews that would take more than MAX_REVIEW_SHARE of a request
+    have their text truncated; the untouched review is kept next to the copy
+    that is sent. Each batch keeps its reviews in original order.
+
+    Args:
+        reviews: List of reviews to analyze
+        model_id: ID of the model
+        prompt_tokens: Tokens used by the fixed part of the prompt
+        echo_text: Whether the model is asked to repeat the review text back
+        max_reviews: Optional cap on the number of reviews per request
+
+    Returns:
+        List of batches; each batch is a list of (original_index, review_sent,
+        original_review) tuples, where review_sent may have truncated text
+    """
+    total_budget, output_budget = request_budget(model_id, prompt_tokens)
+    max_total = max(int(total_budget * MAX_REVIEW_SHARE), 1)
+    max_output = max(int(output_budget * MAX_REVIEW_SHARE), 1)
+
+    items = []
+    for index, original in enumerate(reviews):
+        review = original
+        input_tokens, output_tokens = review_cost(review, echo_text)
+        if input_tokens + output_tokens > max_total or output_tokens > max_output:
+            review = _truncate_review(review, max_total, max_output, echo_text)
+            input_tokens, output_tokens = review_cost(review, echo_text)
+        items.append((index, review, original, input_tokens + output_tokens, output_tokens))
+
+    # First-fit decreasing: place the biggest reviews first
+    bins = []
+    for index, review, original, total_tokens, output_tokens in sorted(items, key=lambda item: -item[3]):
+        for bin_ in bins:
+            if (bin_["total"] + total_tokens <= total_budget
+                    and bin_["output"] + output_tokens <= output_budget
+                    and (max_reviews is None or len(bin_["reviews"]) < max_reviews)):
+                break
+        else:
+            bin_ = {"total": 0, "output": 0, "reviews": []}
+            bins.append(bin_)
+        bin_["total"] += total_tokens
+        bin_["output"] += output_tokens
+        bin_["reviews"].append((index, review, original))
+
+    batches = [sorted(bin_["reviews"], key=lambda item: item[0]) for bin_ in bins]
+    batches.sort(key=lambda batch: batch[0][0])
+    return batches
+
+def _truncate_review(review, max_total, max_output, echo_text):
+    """Shorten a review's text so its estimated cost fits the per-review caps"""
+    text = review.get('review_text', '')
+    text_tokens = estimate_tokens(text)
+    input_tokens, output_tokens = review_cost(review, echo_text)
+    overhead = input_tokens - text_tokens
+
+    # Echoed text is counted once on the way in and OUTPUT_HEADROOM times on the way out
+    per_text_token = 1 + (OUTPUT_HEADROOM if echo_text else 0)
+    fixed = overhead + math.ceil(OUTPUT_TOKENS_PER_REVIEW * OUTPUT_HEADROOM)
+    allowed = int((max_total - fixed) / per_text_token)
+    if echo_text:
+        allowed = min(allowed, int(max_output / OUTPUT_HEADROOM) - OUTPUT_TOKENS_PER_REVIEW)
+
+    truncated = dict(review)
+    truncated['review_text'] = truncate_text(text, max(allowed, 1))
+    return truncated